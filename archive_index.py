@@ -0,0 +1,223 @@
+"""
+Script Title: Archive Index
+Description: This script contains an index of the radar archive, stored in a SQLite database. For each JSON file the
+absolute start and end header.stamp, the number of scans, and the header.stamp and byte offsets of each scan are
+stored. Finding the files with a given name, or the files recorded in a time window, is then a lookup in the database
+instead of listing the data_* directories, and reading the scans between two times opens only the files that overlap
+the window, seeks to the first scan in it, and parses only the scans in the window.
+A file is only indexed again when its size or modification time has changed.
+    python archive_index.py build /path/to/radar_data
+    python archive_index.py query 1692370377 1692370400
+"""
+
+import os
+import glob
+import json
+import sqlite3
+import argparse
+import numpy as np
+import import_data_from_json
+from scan_data import ScanData
+
+# Increase when the index format changes, so the files are indexed again
+INDEX_VERSION = 1
+
+
+class _ByteCountingReader:
+    """
+    Wraps a text file, and converts the character positions from iterate_json_array_with_positions to byte offsets.
+    The positions must be asked for in increasing order, so only the chunks that are not passed yet are kept.
+    """
+    def __init__(self, file):
+        self.file = file
+        self.chunks = []            # [character start, byte start, text] of the chunks that are not passed yet
+        self.number_of_chars = 0
+        self.number_of_bytes = 0
+
+    def read(self, size=-1):
+        text = self.file.read(size)
+        if text:
+            self.chunks.append([self.number_of_chars, self.number_of_bytes, text])
+            self.number_of_chars += len(text)
+            self.number_of_bytes += len(text) if text.isascii() else len(text.encode("utf-8"))
+        return text
+
+    def byte_offset(self, char_position):
+        while len(self.chunks) > 1 and self.chunks[1][0] <= char_position:
+            self.chunks.pop(0)
+        char_start, byte_start, text = self.chunks[0]
+        offset = char_position - char_start
+        if text.isascii():
+            return byte_start + offset
+        # Move the start of the chunk up to the position, so the same characters are not encoded again
+        byte_position = byte_start + len(text[:offset].encode("utf-8"))
+        self.chunks[0] = [char_position, byte_position, text[offset:]]
+        return byte_position
+
+
+def index_scans(file_path):
+    """
+    Returns the header.stamp, the start byte and the end byte of each scan in the file, as numpy arrays
+    """
+    timestamps = []
+    starts = []
+    ends = []
+    # newline="" so the characters are the same as in the file
+    with open(file_path, "r", encoding="utf-8", newline="") as file:
+        reader = _ByteCountingReader(file)
+        for item, start, end in import_data_from_json.iterate_json_array_with_positions(reader):
+            timestamps.append(import_data_from_json.absolute_timestamp(item))
+            starts.append(reader.byte_offset(start))
+            ends.append(reader.byte_offset(end))
+    return np.array(timestamps, dtype=np.float64), np.array(starts, dtype=np.int64), np.array(ends, dtype=np.int64)
+
+
+class ArchiveIndex:
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self.connection = sqlite3.connect(db_path, timeout=60)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        with self.connection:
+            self.connection.execute("""
+                CREATE TABLE IF NOT EXISTS files (
+                    file_path TEXT PRIMARY KEY,
+                    filename TEXT,
+                    size INTEGER,
+                    mtime_ns INTEGER,
+                    index_version INTEGER,
+                    start_time REAL,
+                    end_time REAL,
+                    number_of_scans INTEGER,
+                    scan_timestamps BLOB,
+                    scan_starts BLOB,
+                    scan_ends BLOB
+                )""")
+            self.connection.execute("CREATE INDEX IF NOT EXISTS files_filename ON files (filename)")
+            self.connection.execute("CREATE INDEX IF NOT EXISTS files_start_time ON files (start_time)")
+
+    def add_file(self, file_path):
+        """
+        Indexes the file if it is not in the index or has changed. Returns True if the file was indexed.
+        """
+        file_path = os.path.abspath(file_path)
+        stat = os.stat(file_path)
+        row = self.connection.execute("SELECT size, mtime_ns, index_version FROM files WHERE file_path = ?", (file_path,)).fetchone()
+        if row is not None and tuple(row) == (stat.st_size, stat.st_mtime_ns, INDEX_VERSION):
+            return False
+
+        timestamps, starts, ends = index_scans(file_path)
+        # Files without scans get no time range, so they are never found by time
+        start_time = float(timestamps.min()) if len(timestamps) else None
+        end_time = float(timestamps.max()) if len(timestamps) else None
+        with self.connection:
+            self.connection.execute("INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (file_path, os.path.basename(file_path), stat.st_size, stat.st_mtime_ns, INDEX_VERSION, start_time,
+                 end_time, len(timestamps), timestamps.tobytes(), starts.tobytes(), ends.tobytes()))
+        return True
+
+    def update(self, root):
+        """
+        Indexes the new and changed JSON files under root, and removes the files that no longer exist.
+        Returns the number of files indexed.
+        """
+        number_of_indexed_files = 0
+        for file_path in sorted(glob.glob(os.path.join(root, '**', '*.json'), recursive=True)):
+            try:
+                if self.add_file(file_path):
+                    number_of_indexed_files += 1
+                    print(f"Indexed {file_path}")
+            except (ValueError, KeyError) as error:
+                print(f"Could not index {file_path}: {error!r}")
+        root = os.path.abspath(root)
+        with self.connection:
+            for (file_path,) in self.connection.execute("SELECT file_path FROM files").fetchall():
+                if file_path.startswith(root + os.sep) and not os.path.exists(file_path):
+                    self.connection.execute("DELETE FROM files WHERE file_path = ?", (file_path,))
+        return number_of_indexed_files
+
+    def find_files(self, filenames):
+        """
+        Returns the paths of the indexed files with the given basenames, e.g. from multi_path_scenarios.txt
+        """
+        path_list = []
+        for filename in filenames:
+            row = self.connection.execute("SELECT file_path FROM files WHERE filename = ?", (os.path.basename(filename),)).fetchone()
+            if row is not None:
+                path_list.append(row[0])
+        return path_list
+
+    def files_between(self, start_time, end_time):
+        """
+        Returns (file_path, start_time, end_time, number_of_scans) of the files with scans between start_time and
+        end_time, given as header.stamp in seconds, ordered by start time
+        """
+        return self.connection.execute(
+            "SELECT file_path, start_time, end_time, number_of_scans FROM files "
+            "WHERE start_time <= ? AND end_time >= ? ORDER BY start_time", (end_time, start_time)).fetchall()
+
+    def iterate_scans_between(self, start_time, end_time):
+        """
+        Yields (file_path, timestamp, measurements) for the scans between start_time and end_time, where timestamp is
+        the header.stamp in seconds and measurements are as from import_data_from_json.iterate_scans. Only the part of
+        each file with these scans is read.
+        """
+        for file_path, _, _, _ in self.files_between(start_time, end_time):
+            row = self.connection.execute("SELECT scan_timestamps, scan_starts, scan_ends FROM files WHERE file_path = ?",
+                                          (file_path,)).fetchone()
+            timestamps = np.frombuffer(row[0], dtype=np.float64)
+            starts = np.frombuffer(row[1], dtype=np.int64)
+            ends = np.frombuffer(row[2], dtype=np.int64)
+            selected = np.flatnonzero((timestamps >= start_time) & (timestamps <= end_time))
+            if len(selected) == 0:
+                continue
+
+            with open(file_path, "rb") as file:
+                # The scans are usually in time order, then they are read in one block
+                block_start = starts[selected].min()
+                block_end = ends[selected].max()
+                file.seek(block_start)
+                block = file.read(block_end - block_start)
+            for k in selected:
+                item = json.loads(block[starts[k] - block_start:ends[k] - block_start])
+                yield file_path, float(timestamps[k]), import_data_from_json.scan_measurements(item)
+
+    def import_scan_data_between(self, start_time, end_time):
+        """
+        Returns the scans between start_time and end_time as a ScanData, with the timestamps relative to start_time
+        """
+        scans = ((timestamp - start_time, measurements)
+                 for _, timestamp, measurements in self.iterate_scans_between(start_time, end_time))
+        return ScanData.from_scans(scans)
+
+    def close(self):
+        self.connection.close()
+
+    def __len__(self):
+        return self.connection.execute("SELECT COUNT(*) FROM files").fetchone()[0]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build or query the index of the radar archive")
+    parser.add_argument("--db", default="archive_index.db")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    build_parser = subparsers.add_parser("build", help="Index the new and changed JSON files under root")
+    build_parser.add_argument("root")
+    query_parser = subparsers.add_parser("query", help="List the files and scans between two header.stamp times")
+    query_parser.add_argument("start_time", type=float)
+    query_parser.add_argument("end_time", type=float)
+    args = parser.parse_args()
+
+    index = ArchiveIndex(args.db)
+    if args.command == "build":
+        number_of_indexed_files = index.update(args.root)
+        print(f"Indexed {number_of_indexed_files} files, {len(index)} files in the index")
+    else:
+        for file_path, start_time, end_time, number_of_scans in index.files_between(args.start_time, args.end_time):
+            print(f"{file_path}: {start_time:.2f} - {end_time:.2f}, {number_of_scans} scans")
+        scan_data = index.import_scan_data_between(args.start_time, args.end_time)
+        print(scan_data)
+    index.close()
+
+
+if __name__ == "__main__":
+    main()
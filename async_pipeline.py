@@ -0,0 +1,203 @@
+"""
+Script Title: Async Pipeline
+Description: This script runs the per file pipeline as three asyncio stages connected by bounded queues, so reading,
+analysing and plotting of different files overlap:
+    1. The files are prefetched in a thread, up to max_files_read_ahead files ahead of the analysis: the OS is asked to
+       read the file, or its scan cache file, into the page cache, so the disk reads overlap the analysis of the files
+       before it. Only the file path is passed on, so the data is never copied between the processes.
+    2. The scans are streamed from the file, or loaded from the scan cache in work_dir, checked for multi path and
+       tracked in a process pool, so the CPU work runs alongside the reading and plotting.
+    3. The plots are rendered with the cached basemap from plotting.ReportRenderer, and the PNG encoding and saving is
+       done in a thread pool, with at most max_pending_saves images waiting to be saved.
+When a queue is full the stage before it waits, so the memory use stays capped however many files there are.
+"""
+
+import os
+import asyncio
+import traceback
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import batch_processing
+import land_mask
+import processing_manifest
+import profiling
+import scan_cache
+import utilities
+
+
+def prefetch_file(file_path, work_dir, use_cache=True):
+    """
+    Asks the OS to start reading the file that will be parsed, the cached scans if the file is in the scan cache, into
+    the page cache. Raises OSError if the file can not be opened. Without posix_fadvise, e.g. on Windows, the file is
+    only opened.
+    """
+    path = file_path
+    if use_cache:
+        cache_path = scan_cache.cache_path(file_path, scan_cache.default_cache_dir(work_dir))
+        if os.path.exists(cache_path):
+            path = cache_path
+    with open(path, "rb") as file:
+        if hasattr(os, "posix_fadvise"):
+            os.posix_fadvise(file.fileno(), 0, 0, os.POSIX_FADV_WILLNEED)
+
+
+def _analyse_file_in_worker(file_path, work_dir, make_plot, use_cache, parameters, profiler_settings=None, use_land_mask=False,
+                            hash_file=False):
+    # Runs the parse and analysis of batch_processing.process_file, the plotting is done in the plot stage
+    profiler = profiling.make_profiler(profiler_settings)
+    try:
+        # The land mask is only made once in each worker, and then reused for its next files
+        mask = land_mask.load_land_mask(work_dir) if use_land_mask else None
+        with profiler.file(file_path):
+            if make_plot:
+                scan_data = batch_processing.parse_file(file_path, work_dir, use_cache, profiler)
+                analysis = batch_processing.analyse_scan_data(file_path, scan_data, make_plot, parameters, profiler, mask)
+            else:
+                analysis = batch_processing.detect_file(file_path, work_dir, use_cache, parameters, profiler, mask)
+        if hash_file:
+            # Hashed here, so the plot stage does not read every file again when recording it in the manifest
+            analysis[0]["file_state"] = processing_manifest.file_state(file_path)
+    except Exception:
+        result = batch_processing.new_result(file_path, parameters)
+        result["error"] = traceback.format_exc()
+        analysis = (result, None, None)
+    analysis[0]["profile"] = profiler.file_record(file_path)
+    return analysis
+
+
+async def _read_stage(path_list, read_queue, number_of_analysis_workers, work_dir, use_cache):
+    for file_path in path_list:
+        error = None
+        try:
+            await asyncio.to_thread(prefetch_file, file_path, work_dir, use_cache)
+        except OSError:
+            error = traceback.format_exc()
+        await read_queue.put((file_path, error))
+    # One stop signal for each analysis stage
+    for _ in range(number_of_analysis_workers):
+        await read_queue.put(None)
+
+
+async def _analyse_stage(read_queue, plot_queue, executor, work_dir, make_plot, use_cache, parameters, profiler_settings,
+                         use_land_mask, hash_file):
+    loop = asyncio.get_running_loop()
+    while True:
+        item = await read_queue.get()
+        if item is None:
+            break
+        file_path, error = item
+        if error is not None:
+            result = batch_processing.new_result(file_path, parameters)
+            result["error"] = error
+            await plot_queue.put((result, None, None))
+            continue
+        try:
+            analysis = await loop.run_in_executor(executor, _analyse_file_in_worker, file_path, work_dir, make_plot,
+                                                  use_cache, parameters, profiler_settings, use_land_mask,
+                                                  hash_file)
+        except Exception:
+            # E.g. a worker that died
+            result = batch_processing.new_result(file_path, parameters)
+            result["error"] = traceback.format_exc()
+            analysis = (result, None, None)
+        await plot_queue.put(analysis)
+    await plot_queue.put(None)
+
+
+async def _plot_stage(plot_queue, number_of_analysis_workers, work_dir, registry, manifest, save_executor, max_pending_saves,
+                      profiler, make_plot, heatmap):
+    loop = asyncio.get_running_loop()
+    pending_saves = asyncio.Semaphore(max_pending_saves)
+    save_tasks = []
+    results = []
+
+    def record(result):
+        if manifest is not None and batch_processing.is_finished(result, make_plot):
+            manifest.record(result)
+        if result["multi_path"] and registry is not None:
+            registry.add_result(result)
+
+    async def save(result, image, save_path):
+        # Errors are kept in the result of the file, so a plot that can not be saved does not stop the run
+        try:
+            await loop.run_in_executor(save_executor, plotting.save_png, image, save_path)
+        except Exception:
+            result["error"] = traceback.format_exc()
+            print(f"Failed to save {save_path}:\n{result['error']}")
+            return
+        finally:
+            pending_saves.release()
+        print(f"Saved plot to {save_path}")
+        # The file is only recorded as processed when the plot is saved
+        record(result)
+
+    number_of_stopped_workers = 0
+    while number_of_stopped_workers < number_of_analysis_workers:
+        item = await plot_queue.get()
+        if item is None:
+            number_of_stopped_workers += 1
+            continue
+        result, multi_paths, new_scan_data = item
+        profiler.add_file_record(result.pop("profile", None))
+        if heatmap is not None:
+            heatmap.add_result(result)
+        result.pop("multi_path_positions", None)
+        results.append(result)
+        filename = os.path.basename(result["file_path"])
+        if result["error"] is not None:
+            print(f"[{len(results)}] Failed {filename}:\n{result['error']}")
+            continue
+        if not result["multi_path"]:
+            print(f"[{len(results)}] No multi path scenario in {filename}")
+            record(result)
+            continue
+
+        print(f"[{len(results)}] Multi path scenario in {filename}")
+        if new_scan_data is None:
+            record(result)
+            continue
+        # matplotlib is only imported when there is something to plot
+        import plotting
+        try:
+            save_dir = utilities.make_new_directory(filename, work_dir)
+            with profiler.file(result["file_path"]), profiler.stage("plotting") as stage:
+                stage["count"] = new_scan_data.number_of_measurements()
+                image = plotting.get_report_renderer(work_dir).render(new_scan_data, multi_paths)
+        except Exception:
+            result["error"] = traceback.format_exc()
+            print(f"Failed to plot {filename}:\n{result['error']}")
+            continue
+        await pending_saves.acquire()
+        save_tasks.append(asyncio.create_task(save(result, image, f"{save_dir}/{filename[:-5]}.png")))
+        # save never raises, so the finished tasks can be dropped
+        save_tasks = [task for task in save_tasks if not task.done()]
+
+    await asyncio.gather(*save_tasks)
+    return results
+
+
+async def run_pipeline_async(path_list, work_dir, registry=None, make_plot=True, max_files_read_ahead=2,
+                             number_of_analysis_workers=1, number_of_save_threads=2, max_pending_saves=4,
+                             parameters=None, manifest=None, profiler=None, heatmap=None, use_cache=True,
+                             use_land_mask=False):
+    if profiler is None:
+        profiler = profiling.null_profiler
+    read_queue = asyncio.Queue(maxsize=max_files_read_ahead)
+    plot_queue = asyncio.Queue(maxsize=number_of_analysis_workers)
+    with ProcessPoolExecutor(max_workers=number_of_analysis_workers) as executor, \
+         ThreadPoolExecutor(max_workers=number_of_save_threads) as save_executor:
+        stages = [_read_stage(path_list, read_queue, number_of_analysis_workers, work_dir, use_cache)]
+        for _ in range(number_of_analysis_workers):
+            stages.append(_analyse_stage(read_queue, plot_queue, executor, work_dir, make_plot, use_cache, parameters,
+                                         profiler.settings(), use_land_mask, manifest is not None))
+        stages.append(_plot_stage(plot_queue, number_of_analysis_workers, work_dir, registry, manifest, save_executor, max_pending_saves,
+                                  profiler, make_plot, heatmap))
+        stage_results = await asyncio.gather(*stages)
+    return stage_results[-1]
+
+
+def run_pipeline(path_list, work_dir, registry=None, **kwargs):
+    """
+    Runs the pipeline on all the files in path_list, and returns the list of results. See run_pipeline_async for the
+    queue and worker sizes.
+    """
+    return asyncio.run(run_pipeline_async(path_list, work_dir, registry, **kwargs))
@@ -0,0 +1,242 @@
+"""
+Script Title: Batch Processing
+Description: This script contains the per file pipeline (parse -> detect -> track -> plot) used by main.py, and a batch
+mode which runs the pipeline on many files in parallel using a process pool. The number of files given to the workers
+at the same time is bounded, so the memory use stays capped, and a file that fails is reported without stopping the run.
+"""
+
+import os
+import sys
+import itertools
+import traceback
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+import import_data_from_json
+import land_mask
+import multi_path
+import processing_manifest
+import profiling
+import scan_cache
+import utilities
+
+
+def new_result(file_path, parameters=None):
+    # children_over_land is only set when the files are checked with a land mask
+    return {"file_path": file_path, "multi_path": False, "parents": 0, "children": 0, "children_over_land": None,
+            "parent_timestamps": [], "thresholds": multi_path.get_detector_parameters(parameters), "error": None}
+
+
+def is_finished(result, make_plot=True):
+    """
+    Returns True if the file does not have to be processed again, i.e. it did not fail, and it does not have multi path
+    that is still to be plotted
+    """
+    return result["error"] is None and (make_plot or not result["multi_path"])
+
+
+def add_multi_path_to_result(result, multi_paths, over_land=False):
+    result["multi_path"] = True
+    result["parents"] = multi_paths.get_number_of_parents()
+    result["children"] = multi_paths.get_number_of_children()
+    if over_land:
+        result["children_over_land"] = multi_paths.get_number_of_children_over_land()
+    result["parent_timestamps"] = [float(timestamp) for timestamp in multi_paths.multi_path_scenarios.keys()]
+    result["multi_path_positions"] = multi_paths.get_positions()
+
+
+def analyse_scan_data(file_path, scan_data, make_plot=True, parameters=None, profiler=None, land_mask=None):
+    """
+    Checks the scans for multi path, and if there is multi path and make_plot is True, finds the tracks to plot.
+    Returns the result dict, the MultiPath (or None) and the ScanData with the tracked measurements (or None).
+    parameters can override the values in multi_path.detector_parameters, and the stages are timed by profiler. If a
+    land_mask.LandMask is given, the number of children over land is added to the result.
+    """
+    if profiler is None:
+        profiler = profiling.null_profiler
+    result = new_result(file_path, parameters)
+    with profiler.stage("detection") as stage:
+        stage["count"] = scan_data.number_of_measurements()
+        multi_paths = multi_path.check_for_multi_path(scan_data, parameters, land_mask)
+    if multi_paths is None:
+        return result, None, None
+
+    add_multi_path_to_result(result, multi_paths, land_mask is not None)
+    if not make_plot:
+        return result, multi_paths, None
+
+    with profiler.stage("colour_scaling") as stage:
+        stage["count"] = scan_data.number_of_measurements()
+        scan_data = utilities.add_color_scaling(scan_data)
+    with profiler.stage("tracking") as stage:
+        tracks = utilities.nearest_neighbor(scan_data)
+        stage["count"] = len(tracks)
+    with profiler.stage("filtering") as stage:
+        tracks = utilities.filter_tracks(tracks)
+        stage["count"] = len(tracks)
+    with profiler.stage("conversion") as stage:
+        new_scan_data = utilities.convert_tracks_to_measurement_dict(tracks, scan_data)
+        stage["count"] = new_scan_data.number_of_measurements()
+    return result, multi_paths, new_scan_data
+
+
+def parse_file(file_path, work_dir, use_cache=True, profiler=None):
+    """
+    Returns the ScanData of the file. If use_cache is True the parsed scans are read from, or added to, the scan cache
+    in work_dir.
+    """
+    if profiler is None:
+        profiler = profiling.null_profiler
+    with profiler.stage("parse") as stage:
+        if use_cache:
+            scan_data = scan_cache.load_scan_data(file_path, scan_cache.default_cache_dir(work_dir))
+        else:
+            scan_data = import_data_from_json.import_scan_data(file_path)
+        stage["count"] = scan_data.number_of_measurements()
+    return scan_data
+
+
+def detect_file(file_path, work_dir, use_cache=True, parameters=None, profiler=None, land_mask=None):
+    """
+    Only checks the file for multi path, for runs without plots, and returns the same as analyse_scan_data with
+    make_plot False. If the file is in the scan cache, the cached scans are checked with the vectorized detector.
+    Otherwise the scans are streamed through the detector one at a time, so the whole file is never held in memory, and
+    the file is not added to the cache.
+    """
+    if profiler is None:
+        profiler = profiling.null_profiler
+    if use_cache and os.path.exists(scan_cache.cache_path(file_path, scan_cache.default_cache_dir(work_dir))):
+        scan_data = parse_file(file_path, work_dir, use_cache, profiler)
+        return analyse_scan_data(file_path, scan_data, False, parameters, profiler, land_mask)
+
+    result = new_result(file_path, parameters)
+    with profiler.stage("detection") as stage:
+        stage["count"] = 0
+
+        def counted_scans():
+            # The measurements are counted as they stream past, for the profiling report
+            for timestamp, measurements in import_data_from_json.iterate_scans(file_path):
+                stage["count"] += len(measurements)
+                yield timestamp, measurements
+
+        multi_paths = multi_path.check_for_multi_path(counted_scans(), parameters, land_mask)
+    if multi_paths is not None:
+        add_multi_path_to_result(result, multi_paths, land_mask is not None)
+    return result, multi_paths, None
+
+
+def process_file(file_path, work_dir, make_plot=True, use_cache=True, parameters=None, profiler=None, land_mask=None):
+    """
+    Runs the whole pipeline on one file, and returns a dict with the result. If use_cache is True the parsed scans are
+    read from, or added to, the scan cache in work_dir. If a profiling.Profiler is given, the stages are timed by it,
+    and if a land_mask.LandMask is given, the children over land are counted. Without make_plot the file is only
+    checked with detect_file.
+    """
+    if profiler is None:
+        profiler = profiling.null_profiler
+    with profiler.file(file_path):
+        if not make_plot:
+            result, _, _ = detect_file(file_path, work_dir, use_cache, parameters, profiler, land_mask)
+            return result
+        scan_data = parse_file(file_path, work_dir, use_cache, profiler)
+        result, multi_paths, new_scan_data = analyse_scan_data(file_path, scan_data, make_plot, parameters, profiler, land_mask)
+        if new_scan_data is not None:
+            filename = os.path.basename(file_path)
+            save_dir = utilities.make_new_directory(filename, work_dir)
+            with profiler.stage("plotting") as stage:
+                stage["count"] = new_scan_data.number_of_measurements()
+                # matplotlib is only imported when there is something to plot
+                import plotting
+                plotting.plot_for_report(new_scan_data, multi_paths, save_dir, filename, work_dir)
+    return result
+
+
+def _process_file_in_worker(file_path, work_dir, make_plot, parameters, profiler_settings=None, use_land_mask=False,
+                            hash_file=False):
+    # Errors are returned instead of raised, so the traceback from the worker is kept in the result
+    profiler = profiling.make_profiler(profiler_settings)
+    try:
+        # The land mask is only made once in each worker, and then reused for its next files
+        mask = land_mask.load_land_mask(work_dir) if use_land_mask else None
+        result = process_file(file_path, work_dir, make_plot, parameters=parameters, profiler=profiler, land_mask=mask)
+        if hash_file:
+            # Hashed here, so the process recording the results in the manifest does not read every file again
+            result["file_state"] = processing_manifest.file_state(file_path)
+    except Exception:
+        result = new_result(file_path, parameters)
+        result["error"] = traceback.format_exc()
+    # The stage timings are sent back with the result, and added to the profiler of the run
+    result["profile"] = profiler.file_record(file_path)
+    return result
+
+
+def _initialize_worker():
+    # The workers only save figures, so no window system is needed. matplotlib is not imported here, so workers that
+    # only check files without multi path never import it
+    if "matplotlib" in sys.modules:
+        sys.modules["matplotlib"].use("Agg")
+    else:
+        os.environ["MPLBACKEND"] = "Agg"
+
+
+def run_batch(path_list, work_dir, registry=None, number_of_workers=None, max_files_in_flight=None, make_plot=True,
+              parameters=None, manifest=None, profiler=None, heatmap=None, use_land_mask=False):
+    """
+    Runs process_file on all the files in path_list using number_of_workers processes, with at most max_files_in_flight
+    files submitted at the same time. The results are collected here, files with multi path are added to the
+    ScenarioRegistry registry, the files that did not fail are recorded in the ProcessingManifest manifest, the
+    stage timings from the workers are added to the profiling.Profiler profiler, and the parents and children are added
+    to the multi_path_heatmap.MultiPathHeatmap heatmap. If use_land_mask is True, each worker loads the land mask from
+    work_dir and counts the children over land.
+    Returns the list of results, in the order the files finished.
+    """
+    if profiler is None:
+        profiler = profiling.null_profiler
+    if number_of_workers is None:
+        number_of_workers = os.cpu_count() or 1
+    if max_files_in_flight is None:
+        max_files_in_flight = 2*number_of_workers
+
+    results = []
+    paths = iter(path_list)
+    with ProcessPoolExecutor(max_workers=number_of_workers, initializer=_initialize_worker) as executor:
+        in_flight = {}
+        for file_path in itertools.islice(paths, max_files_in_flight):
+            in_flight[executor.submit(_process_file_in_worker, file_path, work_dir, make_plot, parameters, profiler.settings(), use_land_mask,
+                                      manifest is not None)] = file_path
+
+        while in_flight:
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                file_path = in_flight.pop(future)
+                try:
+                    result = future.result()
+                except Exception:
+                    # E.g. a worker that died, the other files are still processed
+                    result = new_result(file_path, parameters)
+                    result["error"] = traceback.format_exc()
+                profiler.add_file_record(result.pop("profile", None))
+                if heatmap is not None:
+                    heatmap.add_result(result)
+                # The positions are only needed for the heatmap, so they are not kept for the whole run
+                result.pop("multi_path_positions", None)
+                results.append(result)
+                if manifest is not None and is_finished(result, make_plot):
+                    manifest.record(result)
+
+                filename = os.path.basename(file_path)
+                if result["error"] is not None:
+                    print(f"[{len(results)}] Failed {filename}:\n{result['error']}")
+                elif result["multi_path"]:
+                    print(f"[{len(results)}] Multi path scenario in {filename}")
+                    if registry is not None:
+                        registry.add_result(result)
+                else:
+                    print(f"[{len(results)}] No multi path scenario in {filename}")
+
+                for next_file_path in itertools.islice(paths, 1):
+                    in_flight[executor.submit(_process_file_in_worker, next_file_path, work_dir, make_plot, parameters, profiler.settings(), use_land_mask,
+                                              manifest is not None)] = next_file_path
+
+    number_of_failed = sum(1 for result in results if result["error"] is not None)
+    number_of_multi_paths = sum(1 for result in results if result["multi_path"])
+    print(f"Processed {len(results)} files, {number_of_multi_paths} with multi path, {number_of_failed} failed")
+    return results
@@ -0,0 +1,162 @@
+"""
+Script Title: Benchmark
+Description: This script benchmarks the stages of the pipeline on synthetic recordings from synthetic_data.py, at a
+number of scales. For each stage the best and mean wall time, the throughput in scans and measurements per second,
+the latency per scan and the peak memory (traced with tracemalloc in a separate run) are measured. The results are
+saved as a JSON file in benchmark_results, and two result files can be compared to see the change between runs:
+    python benchmark.py --scales small medium
+    python benchmark.py --compare benchmark_results/old.json benchmark_results/new.json
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import datetime
+import platform
+import tempfile
+import tracemalloc
+import numpy as np
+import matplotlib
+matplotlib.use("Agg")
+import import_data_from_json
+import multi_path
+import plotting
+import synthetic_data
+import utilities
+
+# The arguments to synthetic_data.generate_scans for each scale
+scales = {
+    "small": {"number_of_scans": 100, "clusters_per_scan": 10, "points_per_hull": 8, "multi_path_every": 5},
+    "medium": {"number_of_scans": 500, "clusters_per_scan": 30, "points_per_hull": 8, "multi_path_every": 5},
+    "large": {"number_of_scans": 2000, "clusters_per_scan": 60, "points_per_hull": 12, "multi_path_every": 5},
+}
+
+
+def measure(function, repeats=3):
+    """
+    Runs function repeats times, and once more with tracemalloc to find the peak memory.
+    Returns the output of the function, the wall times and the peak memory in bytes.
+    """
+    times = []
+    for _ in range(repeats):
+        start_time = time.perf_counter()
+        output = function()
+        times.append(time.perf_counter() - start_time)
+    tracemalloc.start()
+    function()
+    _, peak_memory = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return output, times, peak_memory
+
+
+def benchmark_file(file_path, work_dir, save_dir, repeats=3):
+    """
+    Benchmarks each stage of the pipeline on the file, and returns a list with a dict for each stage
+    """
+    stages = []
+
+    def run(stage, function):
+        output, times, peak_memory = measure(function, repeats)
+        stages.append({"stage": stage, "best_time": min(times), "mean_time": float(np.mean(times)), "peak_memory": peak_memory})
+        return output
+
+    measurement_dict = run("import_data_from_json", lambda: import_data_from_json.import_data_from_json(file_path))
+    scan_data = run("import_scan_data", lambda: import_data_from_json.import_scan_data(file_path))
+    measurement_dict.pop('Timestamp')
+    run("check_for_multi_path_dict", lambda: multi_path.check_for_multi_path(measurement_dict))
+    multi_paths = run("check_for_multi_path", lambda: multi_path.check_for_multi_path(scan_data))
+    scan_data = run("add_color_scaling", lambda: utilities.add_color_scaling(scan_data))
+    tracks = run("nearest_neighbor", lambda: utilities.nearest_neighbor(scan_data))
+    tracks = run("filter_tracks", lambda: utilities.filter_tracks(tracks))
+    new_scan_data = run("convert_tracks_to_measurement_dict", lambda: utilities.convert_tracks_to_measurement_dict(tracks, scan_data))
+    if multi_paths is not None:
+        run("plot_for_report", lambda: plotting.plot_for_report(new_scan_data, multi_paths, save_dir, "benchmark.json", work_dir))
+
+    number_of_scans = scan_data.number_of_scans()
+    number_of_measurements = scan_data.number_of_measurements()
+    for stage in stages:
+        stage["scans_per_second"] = number_of_scans/stage["best_time"]
+        stage["measurements_per_second"] = number_of_measurements/stage["best_time"]
+        stage["latency_per_scan"] = stage["best_time"]/number_of_scans
+    return stages, number_of_scans, number_of_measurements
+
+
+def run_benchmarks(scale_names, work_dir, repeats=3):
+    """
+    Generates a recording for each scale and benchmarks it. Returns the results as a dict.
+    """
+    results = {"time": datetime.datetime.now().isoformat(timespec="seconds"),
+               "python": sys.version.split()[0], "numpy": np.__version__, "matplotlib": matplotlib.__version__,
+               "platform": platform.platform(), "processor": platform.processor(), "repeats": repeats, "scales": {}}
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for scale_name in scale_names:
+            file_path = synthetic_data.write_synthetic_json(os.path.join(tmp_dir, f"{scale_name}.json"), **scales[scale_name])
+            stages, number_of_scans, number_of_measurements = benchmark_file(file_path, work_dir, tmp_dir, repeats)
+            results["scales"][scale_name] = {"generator": scales[scale_name], "file_size": os.path.getsize(file_path),
+                                             "number_of_scans": number_of_scans,
+                                             "number_of_measurements": number_of_measurements, "stages": stages}
+            print_scale(scale_name, results["scales"][scale_name])
+    return results
+
+
+def print_scale(scale_name, scale_results):
+    print(f"\n{scale_name}: {scale_results['number_of_scans']} scans, {scale_results['number_of_measurements']} measurements")
+    print(f"{'stage':<36}{'best [s]':>10}{'mean [s]':>10}{'scans/s':>12}{'ms/scan':>10}{'peak [MB]':>11}")
+    for stage in scale_results["stages"]:
+        print(f"{stage['stage']:<36}{stage['best_time']:>10.4f}{stage['mean_time']:>10.4f}{stage['scans_per_second']:>12.0f}"
+              f"{1000*stage['latency_per_scan']:>10.3f}{stage['peak_memory']/2**20:>11.1f}")
+
+
+def save_results(results, results_dir):
+    os.makedirs(results_dir, exist_ok=True)
+    results_path = os.path.join(results_dir, f"benchmark_{datetime.datetime.now():%Y-%m-%d-%H-%M-%S}.json")
+    with open(results_path, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"\nSaved results to {results_path}")
+    return results_path
+
+
+def compare_results(old_results_path, new_results_path):
+    """
+    Prints the time and peak memory of each stage in the new results relative to the old results
+    """
+    with open(old_results_path, "r") as f:
+        old_results = json.load(f)
+    with open(new_results_path, "r") as f:
+        new_results = json.load(f)
+
+    for scale_name, new_scale in new_results["scales"].items():
+        if scale_name not in old_results["scales"]:
+            continue
+        old_stages = {stage["stage"]: stage for stage in old_results["scales"][scale_name]["stages"]}
+        print(f"\n{scale_name}")
+        print(f"{'stage':<36}{'old [s]':>10}{'new [s]':>10}{'speedup':>10}{'memory':>10}")
+        for stage in new_scale["stages"]:
+            old_stage = old_stages.get(stage["stage"])
+            if old_stage is None:
+                continue
+            print(f"{stage['stage']:<36}{old_stage['best_time']:>10.4f}{stage['best_time']:>10.4f}"
+                  f"{old_stage['best_time']/stage['best_time']:>9.2f}x{stage['peak_memory']/max(old_stage['peak_memory'], 1):>9.2f}x")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the pipeline stages on synthetic recordings")
+    parser.add_argument("--scales", nargs="+", choices=list(scales), default=["small", "medium"])
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--work-dir", default=os.path.dirname(os.path.abspath(__file__)),
+                        help="Directory with npy_files, used for the plots")
+    parser.add_argument("--results-dir", default="benchmark_results")
+    parser.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"), help="Compare two result files instead of running")
+    args = parser.parse_args()
+
+    if args.compare:
+        compare_results(*args.compare)
+        return
+    results = run_benchmarks(args.scales, args.work_dir, args.repeats)
+    save_results(results, args.results_dir)
+
+
+if __name__ == "__main__":
+    main()
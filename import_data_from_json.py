@@ -1,51 +1,168 @@
 import json
 import numpy as np
+from scan_data import ScanData
+import scan_store
 
-def import_data_from_json(file_path: str):
-    measurement_dict = {}
-    measurement_dict['Timestamp'] = ["x","y","area","polygon_xs","polygon_ys"]
-    measurement_dict_for_debugging = {}
-    measurement_dict_for_debugging['Timestamp'] = ["x","y","area"]
+# Increase when the parsing changes, so the cached scans in scan_cache are parsed again
+PARSER_VERSION = 1
+
+def iterate_json_array(file, chunk_size=2**20):
+    """
+    Yields the elements of a top level JSON array one at a time, so the whole file never has to be held in memory
+    """
+    for element, _, _ in iterate_json_array_with_positions(file, chunk_size):
+        yield element
+
+def iterate_json_array_with_positions(file, chunk_size=2**20):
+    """
+    Same as iterate_json_array, but yields (element, start, end), where start and end are the positions of the element
+    in the file, counted in characters from the start of the file
+    """
+    decoder = json.JSONDecoder()
+    buffer = file.read(chunk_size)
+    buffer_start = 0    # Position of buffer[0] in the file
+    position = 0
+    end_of_file = not buffer
+    expecting = "start"
+    while True:
+        # Skip whitespace, and read more of the file if the buffer runs out
+        while True:
+            while position < len(buffer) and buffer[position] in " \t\r\n":
+                position += 1
+            if position < len(buffer) or end_of_file:
+                break
+            buffer_start += len(buffer)
+            buffer = file.read(chunk_size)
+            position = 0
+            end_of_file = not buffer
+        if position >= len(buffer):
+            raise ValueError("Unexpected end of file while reading JSON array")
+
+        char = buffer[position]
+        if expecting == "start":
+            if char != "[":
+                raise ValueError("Expected the JSON file to contain an array")
+            position += 1
+            expecting = "element_or_end"
+            continue
+        if char == "]" and expecting != "element":
+            return
+        if expecting == "separator":
+            if char != ",":
+                raise ValueError(f"Expected ',' in JSON array, got {char!r}")
+            position += 1
+            expecting = "element"
+            continue
+
+        try:
+            element, position_end = decoder.raw_decode(buffer, position)
+            complete = True
+            if isinstance(element, (int, float)) and not isinstance(element, bool) and not end_of_file:
+                # A number at the end of the buffer, e.g. 12 of 123 or 1 of 1e-7, may continue in the part of the file
+                # that is not read yet
+                number_end = position_end
+                while number_end < len(buffer) and buffer[number_end] in "0123456789+-.eE":
+                    number_end += 1
+                complete = number_end < len(buffer)
+        except json.JSONDecodeError:
+            if end_of_file:
+                raise
+            complete = False
+        if not complete:
+            # The element is not complete yet, keep the unread part and read at least as much again
+            more = file.read(max(chunk_size, len(buffer) - position))
+            end_of_file = not more
+            buffer_start += position
+            buffer = buffer[position:] + more
+            position = 0
+            continue
+        yield element, buffer_start + position, buffer_start + position_end
+        position = position_end
+        expecting = "separator"
+
+def iterate_scans(file_path: str):
+    """
+    Yields (timestamp, measurements) for one scan at a time, where measurements is a list of [x,y,area,polygon_xs,polygon_ys].
+    Only type 3 clusters are kept, and the timestamps are relative to the first scan.
+    """
     with open(file_path, 'r') as file:
-        data = json.load(file)
-    
-    # Define the first timestamp
-    timestamp = data[0]["header"]["stamp"]["secs"]
-    timestamps_nano = data[0]["header"]["stamp"]["nsecs"]
-    first_timestamp = timestamp + timestamps_nano*10**(-9)
-
-    for k, item in enumerate(data):
+        yield from iterate_scans_in_file(file)
+
+def iterate_scans_in_file(file):
+    """
+    Same as iterate_scans, but reads from an open text file, e.g. io.StringIO
+    """
+    for k, item in enumerate(iterate_json_array(file)):
         if k == 0:
+            # Define the first timestamp
+            first_timestamp = absolute_timestamp(item)
             timestamp = 0
         else:
-            timestamp = item["header"]["stamp"]["secs"]
-            timestamps_nano = item["header"]["stamp"]["nsecs"]
-            timestamp = timestamp + timestamps_nano*10**(-9) - first_timestamp
-
-        measurement_dict[timestamp] = []
-        measurement_dict_for_debugging[timestamp] = []
-        item_data = item["scan"]
-        for i, measurement in enumerate(item_data):
-            if measurement["type"] == 3:
-                y = measurement["cluster_centroid"]["x"]
-                x = measurement["cluster_centroid"]["y"]
-                area = measurement["area"]
-                xs = []
-                ys = []
-                for point in measurement["hull"]["points"]:
-                    xs.append(point["y"])
-                    ys.append(point["x"])
-            
-                xs.append(xs[0])
-                ys.append(ys[0])
-            else:
-                continue
-            
-            measurement_dict[timestamp].append([x,y,area,xs,ys])
-            measurement_dict_for_debugging[timestamp].append((x,y,area))
-    np.save('measurement_dict_for_debugging.npy', measurement_dict_for_debugging)
-    np.save('measurement_dict.npy', measurement_dict)
+            timestamp = absolute_timestamp(item) - first_timestamp
+        yield timestamp, scan_measurements(item)
+
+def absolute_timestamp(item):
+    """
+    Returns the header.stamp of a scan in seconds
+    """
+    return item["header"]["stamp"]["secs"] + item["header"]["stamp"]["nsecs"]*10**(-9)
+
+def scan_measurements(item):
+    """
+    Returns the measurements of a scan as a list of [x,y,area,polygon_xs,polygon_ys], with only the type 3 clusters
+    """
+    measurements = []
+    for measurement in item["scan"]:
+        if measurement["type"] == 3:
+            y = measurement["cluster_centroid"]["x"]
+            x = measurement["cluster_centroid"]["y"]
+            area = measurement["area"]
+            xs = []
+            ys = []
+            for point in measurement["hull"]["points"]:
+                xs.append(point["y"])
+                ys.append(point["x"])
+
+            xs.append(xs[0])
+            ys.append(ys[0])
+        else:
+            continue
+
+        measurements.append([x,y,area,xs,ys])
+    return measurements
+
+def import_data_from_json(file_path: str, save_debugging_files=False):
+    measurement_dict = {}
+    measurement_dict['Timestamp'] = ["x","y","area","polygon_xs","polygon_ys"]
+    measurement_dict_for_debugging = {}
+    measurement_dict_for_debugging['Timestamp'] = ["x","y","area"]
+
+    for timestamp, measurements in iterate_scans(file_path):
+        measurement_dict[timestamp] = measurements
+        measurement_dict_for_debugging[timestamp] = [(x,y,area) for x,y,area,_,_ in measurements]
+    if save_debugging_files:
+        np.save('measurement_dict_for_debugging.npy', measurement_dict_for_debugging)
+        np.save('measurement_dict.npy', measurement_dict)
     return measurement_dict
-       
-        
 
+def import_scan_data(file_path: str):
+    """
+    Imports the file into a ScanData object, which stores the measurements in flat arrays instead of the measurement_dict
+    """
+    return ScanData.from_scans(iterate_scans(file_path))
+
+def convert_json_to_scan_store(file_path: str, store_dir: str):
+    """
+    Converts the file to a scan store in store_dir, which can then be opened memory-mapped with import_data_from_scan_store
+    """
+    scan_store.write_scan_store(import_scan_data(file_path), store_dir, source_file=file_path)
+
+def import_data_from_scan_store(store_dir: str, start_time=None, end_time=None):
+    """
+    Opens a scan store made by convert_json_to_scan_store without reading it into memory. If start_time or end_time is
+    given, only the scans in that time window are returned, as views into the memory-mapped arrays.
+    """
+    scan_data = scan_store.open_scan_store(store_dir)
+    if start_time is not None or end_time is not None:
+        scan_data = scan_data.time_window(start_time, end_time)
+    return scan_data
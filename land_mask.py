@@ -0,0 +1,136 @@
+"""
+Script Title: Land Mask
+Description: This script contains a lookup table of which positions around the radar are land, made from the occupancy
+grid in npy_files. The table is in polar coordinates around the radar (range x bearing, with the bearing as theta in
+multi_path, from east counterclockwise), so checking if a measurement is over land is an index into the table, and for
+each bearing the range to the first land on the other side of the water is also stored.
+Making the table takes a moment, so it is only made once per process and is cached in npy_files next to the grid. The
+cache is made again if the grid file or the table settings change.
+Positions outside the occupancy grid, or further away than max_range, are counted as water.
+"""
+
+import os
+import numpy as np
+
+# Value of land in the occupancy grid
+LAND = 100
+
+_land_masks = {}
+
+
+class LandMask:
+    def __init__(self, is_land, land_range, max_range, range_bin_size, number_of_bearing_bins):
+        self.is_land_table = is_land        # bool array, range bins x bearing bins
+        self.land_range = land_range        # For each bearing bin, the range to the first land after water, or inf
+        self.max_range = max_range
+        self.range_bin_size = range_bin_size
+        self.number_of_bearing_bins = number_of_bearing_bins
+        self.number_of_range_bins = is_land.shape[0]
+
+    @classmethod
+    def from_occupancy_grid(cls, occupancy_grid, origin_x, origin_y, max_range=150, range_bin_size=0.5, number_of_bearing_bins=3600):
+        """
+        Makes the table by looking up the center of each polar cell in the grid. The grid is drawn in plotting.plot with
+        origin="upper", so the position (x, y) relative to the radar is in column floor(x + origin_x) and row
+        height - 1 - floor(y + origin_y).
+        """
+        number_of_range_bins = int(np.ceil(max_range/range_bin_size))
+        ranges = (np.arange(number_of_range_bins) + 0.5)*range_bin_size
+        bearings = (np.arange(number_of_bearing_bins) + 0.5)*2*np.pi/number_of_bearing_bins
+        xs = ranges[:, None]*np.cos(bearings)[None, :]
+        ys = ranges[:, None]*np.sin(bearings)[None, :]
+
+        height, width = occupancy_grid.shape
+        columns = np.floor(xs + origin_x).astype(int)
+        rows = height - 1 - np.floor(ys + origin_y).astype(int)
+        inside_grid = (columns >= 0) & (columns < width) & (rows >= 0) & (rows < height)
+        is_land = np.zeros(xs.shape, dtype=bool)
+        is_land[inside_grid] = occupancy_grid[rows[inside_grid], columns[inside_grid]] == LAND
+
+        # The radar stands on land, so the land range is to the first land after the first water along each bearing
+        land_range = np.full(number_of_bearing_bins, np.inf)
+        is_water = ~is_land
+        has_water = is_water.any(axis=0)
+        first_water = np.argmax(is_water, axis=0)
+        land_after_water = is_land & (np.arange(number_of_range_bins)[:, None] > first_water[None, :])
+        has_land_after_water = land_after_water.any(axis=0)
+        land_range[has_land_after_water] = np.argmax(land_after_water, axis=0)[has_land_after_water]*range_bin_size
+        land_range[~has_water] = 0.0
+        return cls(is_land, land_range, max_range, range_bin_size, number_of_bearing_bins)
+
+    def bins(self, r, theta):
+        """
+        Returns the range and bearing bins of r and theta, and if they are inside the table
+        """
+        range_bins = np.floor(np.asarray(r)/self.range_bin_size).astype(int)
+        bearing_bins = np.floor(np.mod(theta, 2*np.pi)/(2*np.pi)*self.number_of_bearing_bins).astype(int)
+        bearing_bins = np.minimum(bearing_bins, self.number_of_bearing_bins - 1)
+        inside = (range_bins >= 0) & (range_bins < self.number_of_range_bins)
+        return np.where(inside, range_bins, 0), bearing_bins, inside
+
+    def is_land(self, r, theta):
+        """
+        Returns True for the polar positions over land, works on single values and arrays
+        """
+        range_bins, bearing_bins, inside = self.bins(r, theta)
+        return inside & self.is_land_table[range_bins, bearing_bins]
+
+    def is_land_xy(self, x, y):
+        x = np.asarray(x, dtype=float)
+        y = np.asarray(y, dtype=float)
+        return self.is_land(np.sqrt(x**2 + y**2), np.arctan2(y, x))
+
+    def distance_to_land(self, theta):
+        """
+        Returns the range to the first land on the other side of the water in the direction theta, or inf
+        """
+        _, bearing_bins, _ = self.bins(0, theta)
+        return self.land_range[bearing_bins]
+
+    def save(self, file, **info):
+        np.savez(file, is_land=self.is_land_table, land_range=self.land_range, max_range=self.max_range,
+                 range_bin_size=self.range_bin_size, number_of_bearing_bins=self.number_of_bearing_bins, **info)
+
+    @classmethod
+    def load(cls, file):
+        with np.load(file) as data:
+            return cls(data["is_land"], data["land_range"], float(data["max_range"]), float(data["range_bin_size"]),
+                       int(data["number_of_bearing_bins"]))
+
+    def __repr__(self) -> str:
+        return (f"LandMask: {self.number_of_range_bins} x {self.number_of_bearing_bins} bins, "
+                f"{100*self.is_land_table.mean():.1f} % land within {self.max_range} m")
+
+
+def load_land_mask(work_dir, grid_filename="occupancy_grid.npy", max_range=150, range_bin_size=0.5, number_of_bearing_bins=3600):
+    """
+    Returns the LandMask for the grid in work_dir/npy_files. It is loaded from the cache, or made and cached, the first
+    time it is asked for in the process.
+    """
+    grid_path = os.path.join(work_dir, "npy_files", grid_filename)
+    settings = (max_range, range_bin_size, number_of_bearing_bins)
+    key = (os.path.abspath(grid_path), settings)
+    if key in _land_masks:
+        return _land_masks[key]
+
+    stat = os.stat(grid_path)
+    source = np.array([stat.st_size, stat.st_mtime_ns], dtype=np.int64)
+    cache_path = os.path.join(work_dir, "npy_files", f"land_mask_{os.path.splitext(grid_filename)[0]}.npz")
+    land_mask = None
+    if os.path.exists(cache_path):
+        with np.load(cache_path) as data:
+            up_to_date = (np.array_equal(data["source"], source)
+                          and (float(data["max_range"]), float(data["range_bin_size"]), int(data["number_of_bearing_bins"])) == settings)
+        if up_to_date:
+            land_mask = LandMask.load(cache_path)
+
+    if land_mask is None:
+        data = np.load(grid_path, allow_pickle=True).item()
+        land_mask = LandMask.from_occupancy_grid(data["occupancy_grid"], data["origin_x"], data["origin_y"], *settings)
+        # Written to a temporary file first, so other processes never read a half written cache
+        temporary_path = f"{cache_path[:-4]}.{os.getpid()}.tmp.npz"
+        land_mask.save(temporary_path, source=source)
+        os.replace(temporary_path, cache_path)
+
+    _land_masks[key] = land_mask
+    return land_mask
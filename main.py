@@ -5,64 +5,216 @@ Email: petthang@stud.ntnu.no
 Date: February 27, 2024
 Description: 
 """
+import argparse
 import glob
+import json
 import os
-import import_data_from_json
+import archive_index
+import batch_processing
+import land_mask
 import multi_path
-import plotting
-import utilities
+import multi_path_heatmap
+import processing_manifest
+import profiling
+import scenario_registry
 
 """
 IMPORTANT: Need to change the radar_data_path and wokring_directory to the correct paths!!
+These are the defaults, they can also be given on the command line, see python main.py --help
 """
 work_dir = os.getcwd()
 radar_data_path = "/home/aflaptop/Documents/radar_data"
 
+# Batch mode runs the files in parallel, with number_of_workers=None using all cores
+use_batch_mode = False
+number_of_workers = None
+max_files_in_flight = None
+# The async pipeline reads the next file while the current one is analysed, and saves the plots in threads
+use_async_pipeline = False
+# Only process files that are new, modified, or were processed with other detector parameters
+skip_processed_files = True
+# Overrides of multi_path.detector_parameters, e.g. {"cluster_area_threshold": 200}
+detector_parameters = None
+# Count the children over land with the land mask made from the occupancy grid in npy_files
+use_land_mask = False
+# Time the stages of each file and save the report in work_dir/profiling. trace_memory uses tracemalloc for the peak
+# memory of each stage, and cprofile_dir saves cProfile stats of each file there
+profile_stages = False
+trace_memory = False
+cprofile_dir = None
 
-def main():
-    # root = f"{radar_data_path}/data_aug_15-18"
-    # root = f"{radar_data_path}/data_aug_18-19"
-    # root = f"{radar_data_path}/data_aug_22-23"
-    # root = f"{radar_data_path}/data_aug_25-26-27"
-    # root = f"{radar_data_path}/data_aug_28-29-30-31"
-    # root = f"{radar_data_path}/data_sep_1-2-3-4-5-6-7"
-    # root = f"{radar_data_path}/data_sep_8-9-11-14"
-    # root = f"{radar_data_path}/data_sep_17-18-19-24"
-    # path_list = glob.glob(os.path.join(root, '*.json'))
-    # path_list = glob.glob(os.path.join(radar_data_path,'**' ,'*.json'))
 
+def parse_arguments(argv=None):
+    if use_async_pipeline:
+        default_mode = "async"
+    elif use_batch_mode:
+        default_mode = "batch"
+    else:
+        default_mode = "sequential"
+
+    parser = argparse.ArgumentParser(description="Check radar recordings for multi path, and plot the ones with multi path")
+    parser.add_argument("paths", nargs="*",
+                        help="JSON files, or directories which are searched for JSON files. Without paths, the files in "
+                             "the scenario registry are checked")
+    parser.add_argument("--work-dir", default=work_dir, help="Directory with npy_files, where the results are saved")
+    parser.add_argument("--radar-data-path", default=radar_data_path,
+                        help="Directory with the data_* directories, where the files in the registry are found")
+    parser.add_argument("--archive-index", metavar="DB_FILE",
+                        help="Find the files in the registry with the index made by archive_index.py, instead of "
+                             "searching RADAR_DATA_PATH")
+    parser.add_argument("--mode", choices=["sequential", "batch", "async"], default=default_mode)
+    parser.add_argument("--workers", type=int, default=number_of_workers, help="Number of processes, default all cores")
+    parser.add_argument("--max-files-in-flight", type=int, default=max_files_in_flight,
+                        help="Number of files submitted to the workers at the same time in batch mode, or read ahead of "
+                             "the analysis in async mode")
+    parser.add_argument("--detect-only", action="store_true",
+                        help="Only check for multi path, without tracking and plotting, so matplotlib is never imported")
+    parser.add_argument("--reprocess", action="store_true", default=not skip_processed_files,
+                        help="Also process the files that are already in the processing manifest")
+    parser.add_argument("--parameter", action="append", default=[], metavar="NAME=VALUE",
+                        help="Override a value in multi_path.detector_parameters, e.g. cluster_area_threshold=200")
+    parser.add_argument("--land-mask", action="store_true", default=use_land_mask,
+                        help="Count the children over land, with the land mask made from npy_files/occupancy_grid.npy. "
+                             "Use --reprocess for files already processed without it")
+    parser.add_argument("--heatmap", metavar="NPZ_FILE",
+                        help="Add the parents and children to the heatmap in NPZ_FILE, which is made if it does not exist, "
+                             "and plot it. Files already in the heatmap with the same detector parameters are not counted again, "
+                             "and processed files with multi path that are not in it are processed again")
+    parser.add_argument("--profile", action="store_true", default=profile_stages,
+                        help="Time the stages and save the report in WORK_DIR/profiling")
+    parser.add_argument("--trace-memory", action="store_true", default=trace_memory)
+    parser.add_argument("--cprofile-dir", default=cprofile_dir)
+    args = parser.parse_args(argv)
+
+    args.parameters = dict(detector_parameters or {})
+    for parameter in args.parameter:
+        name, separator, value = parameter.partition("=")
+        if not separator:
+            parser.error(f"--parameter {parameter} should be NAME=VALUE")
+        try:
+            args.parameters[name] = json.loads(value)
+        except json.JSONDecodeError:
+            parser.error(f"--parameter {parameter} does not have a JSON value, e.g. cluster_area_threshold=200")
+    try:
+        multi_path.get_detector_parameters(args.parameters)
+    except KeyError as error:
+        parser.error(str(error))
+    args.parameters = args.parameters or None
+    return args
+
+
+def find_json_files(paths):
+    path_list = []
+    for path in paths:
+        if os.path.isdir(path):
+            path_list.extend(sorted(glob.glob(os.path.join(path, '**', '*.json'), recursive=True)))
+        else:
+            path_list.append(path)
+    return path_list
+
+
+def main(argv=None):
+    args = parse_arguments(argv)
+    work_dir = args.work_dir
 
     txt_filename = f"{work_dir}/multi_path_scenarios.txt"
-    path_list = utilities.find_files(radar_data_path,txt_filename)
+    registry = scenario_registry.ScenarioRegistry(f"{work_dir}/multi_path_scenarios.db")
+    if len(registry) == 0 and os.path.exists(txt_filename):
+        registry.import_txt(txt_filename)
+    if args.paths:
+        path_list = find_json_files(args.paths)
+    elif args.archive_index is not None:
+        index = archive_index.ArchiveIndex(args.archive_index)
+        path_list = index.find_files(registry.filenames())
+        index.close()
+    else:
+        path_list = registry.find_files(args.radar_data_path)
+
+    heatmap = None
+    if args.heatmap is not None:
+        # np.savez adds .npz to the filename
+        if not args.heatmap.endswith(".npz"):
+            args.heatmap += ".npz"
+        if os.path.exists(args.heatmap):
+            heatmap = multi_path_heatmap.MultiPathHeatmap.load(args.heatmap)
+        else:
+            heatmap = multi_path_heatmap.MultiPathHeatmap()
+
+    manifest = processing_manifest.ProcessingManifest(f"{work_dir}/processed_files.db")
+    if not args.reprocess:
+        number_of_files = len(path_list)
+        path_list = files_to_process(path_list, manifest, args.parameters, heatmap)
+        print(f"Skipping {number_of_files - len(path_list)} files that are already processed")
+
+    profiler = profiling.Profiler(args.trace_memory, args.cprofile_dir) if args.profile else profiling.null_profiler
+
+    make_plot = not args.detect_only
+    if args.mode == "async":
+        # Only imported when used, so the other modes start faster
+        import async_pipeline
+        pipeline_sizes = {"number_of_analysis_workers": args.workers or os.cpu_count() or 1}
+        if args.max_files_in_flight is not None:
+            pipeline_sizes["max_files_read_ahead"] = args.max_files_in_flight
+        async_pipeline.run_pipeline(path_list, work_dir, registry, make_plot=make_plot, parameters=args.parameters,
+                                    manifest=manifest, profiler=profiler, heatmap=heatmap, use_land_mask=args.land_mask,
+                                    **pipeline_sizes)
+    elif args.mode == "batch":
+        batch_processing.run_batch(path_list, work_dir, registry, args.workers, args.max_files_in_flight,
+                                   make_plot=make_plot, parameters=args.parameters, manifest=manifest, profiler=profiler,
+                                   heatmap=heatmap, use_land_mask=args.land_mask)
+    else:
+        mask = land_mask.load_land_mask(work_dir) if args.land_mask else None
+        process_files(path_list, work_dir, registry, manifest, profiler, make_plot, args.parameters, heatmap, mask)
+    registry.export_txt(txt_filename)
+
+    if heatmap is not None:
+        heatmap.save(args.heatmap)
+        print(heatmap)
+        for kind in ("parents", "children"):
+            multi_path_heatmap.plot_heatmap(heatmap, work_dir, f"{os.path.splitext(args.heatmap)[0]}_{kind}.png", kind)
+
+    if args.profile:
+        profiler.print_summary()
+        profiling_dir = f"{work_dir}/profiling"
+        os.makedirs(profiling_dir, exist_ok=True)
+        profiler.save_json(f"{profiling_dir}/profile.json")
+        profiler.save_csv(f"{profiling_dir}/profile.csv")
+
+
+def files_to_process(path_list, manifest, parameters=None, heatmap=None):
+    """
+    Returns the files that are not processed with these detector parameters yet. Processed files with multi path that
+    are not in the heatmap are also returned, so a new heatmap gets the files from the earlier runs.
+    """
+    path_list_to_process = []
+    for file_path in path_list:
+        if manifest.needs_processing(file_path, parameters):
+            path_list_to_process.append(file_path)
+        elif heatmap is not None and not heatmap.contains(file_path, parameters) and manifest.get(file_path)["multi_path"]:
+            path_list_to_process.append(file_path)
+    return path_list_to_process
+
 
-    path_list = [f"{radar_data_path}/data_aug_18-19/rosbag_2023-08-18-18-32-57.json"]
-    path_list = ["/home/aflaptop/Documents/radar_data/data_sep_17-18-19-24/rosbag_2023-09-17-12-12-38.json"]
-    
+def process_files(path_list, work_dir, registry, manifest, profiler, make_plot=True, parameters=None, heatmap=None,
+                  land_mask=None):
     for i, file_path in enumerate(path_list):
-        if True:
-            print(f"Processing file {i+1} of {len(path_list)}")
-            filename = os.path.basename(file_path)
-            print(f"File: {filename}")
-            measurement_dict = import_data_from_json.import_data_from_json(file_path)
-            measurement_dict.pop('Timestamp')
-            
-            multi_paths = multi_path.check_for_multi_path(measurement_dict)
-            if multi_paths is not None:
-                print("Multi path scenario")
-                utilities.write_filenames_to_txt(file_path, txt_filename)
-
-                save_dir = utilities.make_new_directory(filename, work_dir)
-                measurement_dict = utilities.add_color_scaling(measurement_dict)
-                tracks = utilities.nearest_neighbor(measurement_dict)
-                tracks = utilities.filter_tracks(tracks)
-                new_measurement_dict = utilities.convert_tracks_to_measurement_dict(tracks, measurement_dict)
-                plotting.plot_for_report(new_measurement_dict, multi_paths, save_dir, filename, work_dir)
-               
-            else:
-                print("No multi path scenario")
-            
-        
+        print(f"Processing file {i+1} of {len(path_list)}")
+        filename = os.path.basename(file_path)
+        print(f"File: {filename}")
+        result = batch_processing.process_file(file_path, work_dir, make_plot, parameters=parameters, profiler=profiler,
+                                               land_mask=land_mask)
+        if batch_processing.is_finished(result, make_plot):
+            manifest.record(result)
+        if result["multi_path"]:
+            print("Multi path scenario")
+            if result["children_over_land"] is not None:
+                print(f"{result['children_over_land']} of {result['children']} children over land")
+            registry.add_result(result)
+            if heatmap is not None:
+                heatmap.add_result(result)
+        else:
+            print("No multi path scenario")
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -9,13 +9,34 @@ If a valid multi path is found, the MultiPath object is created, and the multi p
 """
 
 import numpy as np
-import matplotlib.pyplot as plt
 import os
 import re
+from scan_data import ScanData
+
+# Tunable parameters
+detector_parameters = {
+    "lenght_from_origin_threshold": 50,     # Parents must be closer to the radar than this [m]
+    "cluster_area_threshold": 150,          # Parents must have a larger cluster area than this
+    "error_margin_degrees": 6,              # Half the width of the sector behind the parent
+    "min_parent_timestamps": 3,             # A multi path needs parents at more timestamps than this
+}
+
+
+def get_detector_parameters(parameters=None):
+    """
+    Returns detector_parameters, with the values in parameters used instead where given
+    """
+    merged_parameters = dict(detector_parameters)
+    if parameters is not None:
+        for key, value in parameters.items():
+            if key not in detector_parameters:
+                raise KeyError(f"Unknown detector parameter {key}")
+            merged_parameters[key] = value
+    return merged_parameters
 
 
 class MultiPathParent:
-    def __init__(self):
+    def __init__(self, error_margin_degrees=None):
         self.timestamp = 0
         self.x = 0
         self.y = 0
@@ -24,7 +45,9 @@ class MultiPathParent:
         self.theta_max = 0
         self.theta = 0
         self.cluster_area = 0
-        self.error_margin_degrees = 6
+        if error_margin_degrees is None:
+            error_margin_degrees = detector_parameters["error_margin_degrees"]
+        self.error_margin_degrees = error_margin_degrees
         self.error_margin_radians = np.deg2rad(self.error_margin_degrees)
     
     def add_measurement(self, timestamp, measurement):
@@ -47,10 +70,12 @@ class MultiPathParent:
         self.theta_max = self.theta + self.error_margin_radians
 
     def plot_parent(self,ax, multi_path_num, origin_x=0, origin_y=0):
+        # Imported here, so the detection does not need matplotlib
+        from matplotlib.patches import Polygon
         ax.plot(self.x + origin_x, self.y + origin_y, marker="o", color="#1f77b4")
         poly_x = np.array(self.polygon_xs) + origin_x
         poly_y = np.array(self.polygon_ys) + origin_y
-        ploy = plt.Polygon(np.array([poly_x,poly_y]).T, closed=True, fill=True, edgecolor='#1f77b4', facecolor='#1f77b4', alpha=0.1,linewidth=3)
+        ploy = Polygon(np.array([poly_x,poly_y]).T, closed=True, fill=True, edgecolor='#1f77b4', facecolor='#1f77b4', alpha=0.1,linewidth=3)
         ax.add_patch(ploy)
 
         # When plotting the sector the theta_min and theta_max is dependent on the direction of travel of the vessel.
@@ -76,6 +101,8 @@ class MultiPathChild:
         self.theta = np.arctan2(self.y, self.x)
         if self.theta < 0:
             self.theta += 2*np.pi
+        # Set when the detector is given a land_mask.LandMask
+        self.over_land = None
 
     def plot_child(self, ax, origin_x=0, origin_y=0):
         ax.plot(self.x + origin_x, self.y + origin_y, marker="o", color="#ff7f0e")
@@ -85,8 +112,11 @@ class MultiPathChild:
         return f"MultiPathChild: x = {self.x:.2f}, y = {self.y:.2f}, r = {self.r:.2f}, theta = {self.theta:.2f}"
 
 class MultiPath:
-    def __init__(self):
+    def __init__(self, min_parent_timestamps=None):
         self.multi_path_scenarios = {}
+        if min_parent_timestamps is None:
+            min_parent_timestamps = detector_parameters["min_parent_timestamps"]
+        self.min_parent_timestamps = min_parent_timestamps
         
 
     def add_multi_path(self, multi_path_parent, multi_path_child):
@@ -107,6 +137,42 @@ class MultiPath:
                     number_of_children += 1
         return number_of_children
 
+    def get_number_of_children_over_land(self):
+        """
+        Returns the number of children over land, which can only be set when the detector was given a land mask
+        """
+        number_of_children_over_land = 0
+        for multi_path_scenario in self.multi_path_scenarios.values():
+            for multi_path_elm in multi_path_scenario:
+                if isinstance(multi_path_elm, MultiPathChild) and multi_path_elm.over_land:
+                    number_of_children_over_land += 1
+        return number_of_children_over_land
+
+    def classify_children(self, land_mask):
+        """
+        Sets over_land for all the children, using a land_mask.LandMask
+        """
+        children = [multi_path_elm for multi_path_scenario in self.multi_path_scenarios.values()
+                    for multi_path_elm in multi_path_scenario if isinstance(multi_path_elm, MultiPathChild)]
+        if not children:
+            return
+        r = np.array([child.r for child in children])
+        theta = np.array([child.theta for child in children])
+        for child, over_land in zip(children, land_mask.is_land(r, theta).tolist()):
+            child.over_land = over_land
+
+    def get_positions(self):
+        """
+        Returns the x and y of the parents and children, relative to the radar, as a dict of lists
+        """
+        positions = {"parent_xs": [], "parent_ys": [], "child_xs": [], "child_ys": []}
+        for multi_path_scenario in self.multi_path_scenarios.values():
+            for multi_path_elm in multi_path_scenario:
+                kind = "child" if isinstance(multi_path_elm, MultiPathChild) else "parent"
+                positions[f"{kind}_xs"].append(float(multi_path_elm.x))
+                positions[f"{kind}_ys"].append(float(multi_path_elm.y))
+        return positions
+
     def __repr__(self) -> str:
         temp_str = ""
         for timestamp, multi_path_scenario in self.multi_path_scenarios.items():
@@ -135,39 +201,36 @@ class MultiPath:
                     multi_path.plot_child(ax, origin_x, origin_y)
 
     def valid_multi_path(self):
-        if len(self.multi_path_scenarios.keys()) > 3:
+        if len(self.multi_path_scenarios.keys()) > self.min_parent_timestamps:
             return True
 
 
-def check_for_multi_path(measurements_dict):
-    # Tunable parameters
-    lenght_from_origin_threshold = 50
-    cluster_area_threshold = 150
-    
+def check_scan_for_multi_path(timestamp, measurements, multi_path, parameters=None):
+    """
+    Checks a single scan for multi path, and adds the MultiPathParents and MultiPathChildren found to multi_path.
+    parameters can override the values in detector_parameters.
+    """
+    parameters = get_detector_parameters(parameters)
+    lenght_from_origin_threshold = parameters["lenght_from_origin_threshold"]
+    cluster_area_threshold = parameters["cluster_area_threshold"]
+
     # Find multipath parents
     potential_multi_paths = []
-    for timestamp, measurements in measurements_dict.items():
-        if timestamp == "Info":
-            continue
-    
-        multi_path_parent = MultiPathParent()
-        for measurement in measurements:
-            lenght_from_origin = np.sqrt(measurement[0]**2 + measurement[1]**2)
-            cluster_area = measurement[2]
-            if lenght_from_origin < lenght_from_origin_threshold:
-                
-                if cluster_area > cluster_area_threshold:
-                    multi_path_parent.add_measurement(timestamp, measurement)
-                    potential_multi_paths.append(multi_path_parent)
-
-    # Verify multipath parents by finding multipath children                
-    multi_path = MultiPath()
-    for multi_path_parent in potential_multi_paths:
-        timestamp = multi_path_parent.timestamp
+    multi_path_parent = MultiPathParent(parameters["error_margin_degrees"])
+    for measurement in measurements:
+        lenght_from_origin = np.sqrt(measurement[0]**2 + measurement[1]**2)
+        cluster_area = measurement[2]
+        if lenght_from_origin < lenght_from_origin_threshold:
 
+            if cluster_area > cluster_area_threshold:
+                multi_path_parent.add_measurement(timestamp, measurement)
+                potential_multi_paths.append(multi_path_parent)
+
+    # Verify multipath parents by finding multipath children
+    for multi_path_parent in potential_multi_paths:
         measurment_inside_sector = []
-        for measurements in measurements_dict[timestamp]:
-            multi_path_child = MultiPathChild(measurements)
+        for measurement in measurements:
+            multi_path_child = MultiPathChild(measurement)
 
 
             if multi_path_parent.theta_min < multi_path_child.theta < multi_path_parent.theta_max:
@@ -176,6 +239,103 @@ def check_for_multi_path(measurements_dict):
                     multi_path.add_multi_path(multi_path_parent, multi_path_child)
 
 
+def check_for_multi_path(measurements_dict, parameters=None, land_mask=None):
+    """
+    Checks for multi path in the measurements. measurements_dict is either a dict with timestamps as keys, a ScanData, or an
+    iterable of (timestamp, measurements) pairs, e.g. import_data_from_json.iterate_scans, which is then consumed one scan at a time.
+    parameters can override the values in detector_parameters. If a land_mask.LandMask is given, the children are
+    marked as over land or not.
+    """
+    if isinstance(measurements_dict, ScanData):
+        return check_for_multi_path_vectorized(measurements_dict, parameters=parameters, land_mask=land_mask)
+    if hasattr(measurements_dict, "items"):
+        scans = measurements_dict.items()
+    else:
+        scans = measurements_dict
+
+    parameters = get_detector_parameters(parameters)
+    multi_path = MultiPath(parameters["min_parent_timestamps"])
+    for timestamp, measurements in scans:
+        if timestamp == "Info":
+            continue
+        check_scan_for_multi_path(timestamp, measurements, multi_path, parameters)
+
+    if multi_path.valid_multi_path():
+        if land_mask is not None:
+            multi_path.classify_children(land_mask)
+        return multi_path
+    else:
+        return None
+
+
+def polar_coordinates(x, y):
+    """
+    Returns r and theta of the arrays x and y, with theta in the range [0, 2pi]
+    """
+    r = np.sqrt(x**2 + y**2)
+    theta = np.arctan2(y, x)
+    theta[theta < 0] += 2*np.pi
+    return r, theta
+
+
+def check_for_multi_path_vectorized(scan_data, wrap_around=False, parameters=None, land_mask=None):
+    """
+    Same as check_for_multi_path, but works on all the measurements of a ScanData at once. The polar coordinates are
+    calculated for the whole file in one go, and the children are found by sorting each scan with a parent by angle and
+    searching for the sector limits, instead of checking every measurement in the scan.
+    If wrap_around is True, sectors crossing 0/2pi also include the children on the other side, which
+    check_for_multi_path does not do, so the result will differ from it.
+    If a land_mask.LandMask is given, the children of each scan are marked as over land or not with one lookup.
+    """
+    parameters = get_detector_parameters(parameters)
+    lenght_from_origin_threshold = parameters["lenght_from_origin_threshold"]
+    cluster_area_threshold = parameters["cluster_area_threshold"]
+    error_margin_radians = MultiPathParent(parameters["error_margin_degrees"]).error_margin_radians
+
+    r, theta = polar_coordinates(scan_data.x, scan_data.y)
+    parent_indices = np.flatnonzero((r < lenght_from_origin_threshold) & (scan_data.area > cluster_area_threshold))
+    parent_scans = np.searchsorted(scan_data.scan_offsets, parent_indices, side="right") - 1
+
+    # check_for_multi_path reuses the same MultiPathParent object for every parent in a scan, so only the last parent
+    # of each scan is checked, once for every parent found in that scan. This is kept to give the same result.
+    scans_with_parents, first_parent, number_of_parents = np.unique(parent_scans, return_index=True, return_counts=True)
+    last_parents = parent_indices[first_parent + number_of_parents - 1]
+
+    multi_path = MultiPath(parameters["min_parent_timestamps"])
+    for scan_index, parent_index, parent_count in zip(scans_with_parents.tolist(), last_parents.tolist(), number_of_parents.tolist()):
+        scan = scan_data.scan_slice(scan_index)
+        order = np.argsort(theta[scan], kind="stable")
+        scan_thetas = theta[scan][order]
+
+        theta_min = theta[parent_index] - error_margin_radians
+        theta_max = theta[parent_index] + error_margin_radians
+        sectors = [(theta_min, theta_max)]
+        if wrap_around:
+            sectors.append((theta_min + 2*np.pi, theta_max + 2*np.pi))
+            sectors.append((theta_min - 2*np.pi, theta_max - 2*np.pi))
+
+        inside_sector = []
+        for sector_min, sector_max in sectors:
+            # The sector limits are not included, as in check_for_multi_path
+            start = np.searchsorted(scan_thetas, sector_min, side="right")
+            stop = np.searchsorted(scan_thetas, sector_max, side="left")
+            inside_sector.append(order[start:stop])
+        children = np.sort(np.concatenate(inside_sector)) + scan.start
+        children = children[r[children] > r[parent_index]]
+        if len(children) == 0:
+            continue
+        over_land = [None]*len(children)
+        if land_mask is not None:
+            over_land = land_mask.is_land(r[children], theta[children]).tolist()
+
+        multi_path_parent = MultiPathParent(parameters["error_margin_degrees"])
+        multi_path_parent.add_measurement(float(scan_data.timestamps[scan_index]), scan_data.measurement(parent_index))
+        for _ in range(parent_count):
+            for child_index, child_over_land in zip(children.tolist(), over_land):
+                multi_path_child = MultiPathChild((float(scan_data.x[child_index]), float(scan_data.y[child_index])))
+                multi_path_child.over_land = child_over_land
+                multi_path.add_multi_path(multi_path_parent, multi_path_child)
+
     if multi_path.valid_multi_path():
         return multi_path
     else:
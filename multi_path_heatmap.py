@@ -0,0 +1,147 @@
+"""
+Script Title: Multi Path Heatmap
+Description: This script contains a heatmap of where around the radar multi path occurs. The positions of the parents
+and children from each file with multi path are counted in fixed polar bins (range x bearing), so the size of the counts
+is the same however many files are added. The bearing is the angle from east, counterclockwise, like theta in multi_path.
+Heatmaps made in parallel can be merged, and a heatmap can be saved and loaded again, so it can be updated with the new
+files in each run. For each file that is added, a short key of the filename and a hash of the detector parameters is
+kept, so a file that is processed again with the same parameters is not counted twice, while a file processed with other
+parameters is counted again. The keys are the only part that grows, by about 30 bytes for each file with multi path.
+The heatmap is drawn on the occupancy grid background from plotting.plot.
+"""
+
+import os
+import json
+import hashlib
+import numpy as np
+import multi_path
+
+
+class MultiPathHeatmap:
+    def __init__(self, max_range=130, range_bin_size=2.0, number_of_bearing_bins=180):
+        self.max_range = max_range
+        self.range_bin_size = range_bin_size
+        self.number_of_bearing_bins = number_of_bearing_bins
+        self.number_of_range_bins = int(np.ceil(max_range/range_bin_size))
+        self.parent_counts = np.zeros((self.number_of_range_bins, number_of_bearing_bins), dtype=np.int64)
+        self.child_counts = np.zeros((self.number_of_range_bins, number_of_bearing_bins), dtype=np.int64)
+        self.number_of_files = 0
+        self.file_keys = set()
+
+    def range_edges(self):
+        return np.arange(self.number_of_range_bins + 1)*self.range_bin_size
+
+    def bearing_edges(self):
+        return np.linspace(0, 2*np.pi, self.number_of_bearing_bins + 1)
+
+    def _add_points(self, counts, xs, ys):
+        xs = np.asarray(xs, dtype=float)
+        ys = np.asarray(ys, dtype=float)
+        r = np.sqrt(xs**2 + ys**2)
+        theta = np.mod(np.arctan2(ys, xs), 2*np.pi)
+        range_bins = np.floor(r/self.range_bin_size).astype(int)
+        bearing_bins = np.minimum(np.floor(theta/(2*np.pi)*self.number_of_bearing_bins).astype(int), self.number_of_bearing_bins - 1)
+        # Points further away than max_range are not counted
+        inside = range_bins < self.number_of_range_bins
+        np.add.at(counts, (range_bins[inside], bearing_bins[inside]), 1)
+
+    def add_positions(self, positions, filename=None, parameters=None):
+        """
+        Adds the parents and children of one file, in the format from MultiPath.get_positions. parameters are the
+        detector parameters the file was checked with. Returns False if the file is already in the heatmap with the
+        same parameters, and then nothing is added.
+        """
+        if filename is not None:
+            key = file_key(filename, parameters)
+            if key in self.file_keys:
+                return False
+            self.file_keys.add(key)
+        self._add_points(self.parent_counts, positions["parent_xs"], positions["parent_ys"])
+        self._add_points(self.child_counts, positions["child_xs"], positions["child_ys"])
+        self.number_of_files += 1
+        return True
+
+    def contains(self, filename, parameters=None):
+        """
+        Returns True if the file is in the heatmap, checked with the detector parameters
+        """
+        return file_key(filename, parameters) in self.file_keys
+
+    def add(self, multi_paths, filename=None, parameters=None):
+        """
+        Adds the parents and children of a MultiPath
+        """
+        return self.add_positions(multi_paths.get_positions(), filename, parameters)
+
+    def add_result(self, result):
+        """
+        Adds a file from a batch_processing result, if it has multi path
+        """
+        if result.get("multi_path_positions") is None:
+            return False
+        return self.add_positions(result["multi_path_positions"], result["file_path"], result["thresholds"])
+
+    def merge(self, other):
+        """
+        Adds the counts of another heatmap with the same bins and other files, e.g. from another worker
+        """
+        if (other.max_range, other.range_bin_size, other.number_of_bearing_bins) != (self.max_range, self.range_bin_size, self.number_of_bearing_bins):
+            raise ValueError("Can only merge heatmaps with the same bins")
+        if self.file_keys & other.file_keys:
+            raise ValueError(f"Both heatmaps have the files {sorted(self.file_keys & other.file_keys)}")
+        self.file_keys |= other.file_keys
+        self.parent_counts += other.parent_counts
+        self.child_counts += other.child_counts
+        self.number_of_files += other.number_of_files
+        return self
+
+    def save(self, file):
+        np.savez(file, max_range=self.max_range, range_bin_size=self.range_bin_size,
+                 number_of_bearing_bins=self.number_of_bearing_bins, parent_counts=self.parent_counts,
+                 child_counts=self.child_counts, number_of_files=self.number_of_files,
+                 file_keys=np.array(sorted(self.file_keys), dtype=str))
+
+    @classmethod
+    def load(cls, file):
+        with np.load(file) as data:
+            heatmap = cls(float(data["max_range"]), float(data["range_bin_size"]), int(data["number_of_bearing_bins"]))
+            heatmap.parent_counts = data["parent_counts"].copy()
+            heatmap.child_counts = data["child_counts"].copy()
+            heatmap.number_of_files = int(data["number_of_files"])
+            heatmap.file_keys = set(data["file_keys"].tolist())
+        return heatmap
+
+    def __repr__(self) -> str:
+        return (f"MultiPathHeatmap: {self.number_of_files} files, {self.parent_counts.sum()} parents, "
+                f"{self.child_counts.sum()} children, {self.number_of_range_bins} x {self.number_of_bearing_bins} bins")
+
+
+def file_key(filename, parameters=None):
+    """
+    Returns the key of a file checked with the detector parameters, the basename of the file and a hash of the values
+    in multi_path.detector_parameters with parameters used instead where given
+    """
+    parameters = json.dumps(multi_path.get_detector_parameters(parameters), sort_keys=True)
+    return f"{os.path.basename(filename)}|{hashlib.sha1(parameters.encode()).hexdigest()[:8]}"
+
+
+def plot_heatmap(heatmap, work_dir, save_path, kind="children"):
+    """
+    Draws the counts of the parents or children on the occupancy grid, and saves the plot to save_path
+    """
+    # Imported here, so the heatmap can be updated without matplotlib
+    import matplotlib.pyplot as plt
+    import plotting
+
+    counts = heatmap.child_counts if kind == "children" else heatmap.parent_counts
+    fig, ax, origin_x, origin_y = plotting.plot(work_dir)
+    bearings, ranges = np.meshgrid(heatmap.bearing_edges(), heatmap.range_edges())
+    xs = origin_x + ranges*np.cos(bearings)
+    ys = origin_y + ranges*np.sin(bearings)
+    mesh = ax.pcolormesh(xs, ys, np.ma.masked_equal(counts, 0), cmap="inferno_r", alpha=0.8, zorder=5)
+    colorbar = fig.colorbar(mesh, ax=ax, fraction=0.03, pad=0.02)
+    colorbar.set_label(f"Multipath {kind}", fontsize=17)
+    ax.set_title(f"Multipath {kind} in {heatmap.number_of_files} files", fontsize=20)
+    fig.savefig(save_path, dpi=100, bbox_inches="tight")
+    plt.close(fig)
+    print(f"Saved heatmap to {save_path}")
@@ -0,0 +1,107 @@
+"""
+Script Title: Online Multi Path
+Description: This script contains a multi path detector which is fed one scan at a time, e.g. from the radar as it is
+running. Each scan is checked with multi_path.check_scan_for_multi_path, and the scans with multi path from the last
+window_length seconds are kept. When they satisfy MultiPath.valid_multi_path (more than 3 parent timestamps) a MultiPath
+event is emitted. A new event is only emitted after rearm_time seconds without any scan with multi path, so a multi path
+that goes on for a long time, with some scans without a parent in between, gives one event.
+replay_json feeds a recorded JSON file to the detector at the recorded speed, faster, or as fast as possible, so the
+online detection can be tested offline.
+"""
+
+import time
+import import_data_from_json
+import multi_path
+from multi_path import MultiPath
+
+
+class OnlineMultiPathDetector:
+    def __init__(self, window_length=30, latency_target=0.05, parameters=None, rearm_time=None):
+        self.window_length = window_length      # Seconds of scans to keep
+        # Seconds without multi path before a new event can be emitted, by default the window length
+        self.rearm_time = window_length if rearm_time is None else rearm_time
+        self.latency_target = latency_target    # Seconds the processing of one scan should take at most
+        self.parameters = multi_path.get_detector_parameters(parameters)
+        self.window = MultiPath(self.parameters["min_parent_timestamps"])  # The scans with multi path in the window, oldest first
+        self.in_multi_path = False
+        self.last_multi_path_timestamp = None
+
+        # Latency statistics
+        self.number_of_scans = 0
+        self.number_of_late_scans = 0
+        self.total_latency = 0
+        self.max_latency = 0
+
+    def add_scan(self, timestamp, measurements):
+        """
+        Checks the scan for multi path, and returns a MultiPath with the scans in the window if a multi path starts
+        with this scan, otherwise None
+        """
+        start_time = time.perf_counter()
+
+        multi_path.check_scan_for_multi_path(timestamp, measurements, self.window, self.parameters)
+        # The scans are added in time order, so the oldest scans are first in the dict
+        scenarios = self.window.multi_path_scenarios
+        while scenarios:
+            oldest_timestamp = next(iter(scenarios))
+            if timestamp - oldest_timestamp <= self.window_length:
+                break
+            del scenarios[oldest_timestamp]
+
+        if timestamp in scenarios:
+            self.last_multi_path_timestamp = timestamp
+
+        event = None
+        if self.window.valid_multi_path():
+            if not self.in_multi_path:
+                event = MultiPath(self.parameters["min_parent_timestamps"])
+                event.multi_path_scenarios = {key: list(value) for key, value in scenarios.items()}
+            self.in_multi_path = True
+        elif self.in_multi_path and timestamp - self.last_multi_path_timestamp > self.rearm_time:
+            # The window can stop being valid for a moment during the same multi path, so the detector is only
+            # re-armed after a quiet period
+            self.in_multi_path = False
+
+        latency = time.perf_counter() - start_time
+        self.number_of_scans += 1
+        self.total_latency += latency
+        self.max_latency = max(self.max_latency, latency)
+        if latency > self.latency_target:
+            self.number_of_late_scans += 1
+        return event
+
+    def mean_latency(self):
+        if self.number_of_scans == 0:
+            return 0.0
+        return self.total_latency/self.number_of_scans
+
+    def __repr__(self) -> str:
+        return (f"OnlineMultiPathDetector: {self.number_of_scans} scans, mean latency = {1000*self.mean_latency():.2f} ms, "
+                f"max latency = {1000*self.max_latency:.2f} ms, {self.number_of_late_scans} scans over the "
+                f"{1000*self.latency_target:.0f} ms target")
+
+
+def replay_json(file_path, speed=1.0):
+    """
+    Yields the scans of a recorded file like they came from the radar. With speed=1 the scans come at the recorded
+    times, with speed=10 ten times as fast, and with speed=None as fast as they can be read.
+    """
+    start_time = time.monotonic()
+    for timestamp, measurements in import_data_from_json.iterate_scans(file_path):
+        if speed is not None:
+            delay = start_time + timestamp/speed - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+        yield timestamp, measurements
+
+
+def detect_online(scans, detector=None):
+    """
+    Feeds the scans to the detector, and yields (timestamp, MultiPath) for each multi path event
+    """
+    if detector is None:
+        detector = OnlineMultiPathDetector()
+    for timestamp, measurements in scans:
+        event = detector.add_scan(timestamp, measurements)
+        if event is not None:
+            yield timestamp, event
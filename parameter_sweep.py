@@ -0,0 +1,168 @@
+"""
+Script Title: Parameter Sweep
+Description: This script evaluates check_for_multi_path for every combination of a grid of detector parameters in one
+pass over each file. The polar coordinates are calculated once per file, and the children of every measurement that
+can be a parent for any of the range and area thresholds are counted once per sector margin. Each combination of
+thresholds then only needs to pick the parents from these counts, the same way check_for_multi_path does.
+The result is a table with one row per file and parameter combination, which can be written to a CSV file:
+    python parameter_sweep.py /path/to/radar_data --cluster-area-threshold 100 150 200 --error-margin-degrees 4 6 8
+"""
+
+import os
+import csv
+import glob
+import json
+import argparse
+import itertools
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import import_data_from_json
+import multi_path
+import scan_cache
+
+
+def count_children(scan_data, r, theta, candidates, error_margin_degrees):
+    """
+    Returns the number of children of each of the candidate parents, for each of the sector margins
+    """
+    error_margins = [np.deg2rad(degrees) for degrees in error_margin_degrees]
+    number_of_children = np.zeros((len(candidates), len(error_margins)), dtype=np.int64)
+    candidate_scans = np.searchsorted(scan_data.scan_offsets, candidates, side="right") - 1
+
+    start = 0
+    while start < len(candidates):
+        # The candidates in the same scan share the sorting by angle
+        scan_index = candidate_scans[start]
+        stop = start
+        while stop < len(candidates) and candidate_scans[stop] == scan_index:
+            stop += 1
+        scan = scan_data.scan_slice(scan_index)
+        order = np.argsort(theta[scan], kind="stable")
+        scan_thetas = theta[scan][order]
+        scan_rs = r[scan][order]
+
+        for k in range(start, stop):
+            parent = candidates[k]
+            for m, error_margin in enumerate(error_margins):
+                lower = np.searchsorted(scan_thetas, theta[parent] - error_margin, side="right")
+                upper = np.searchsorted(scan_thetas, theta[parent] + error_margin, side="left")
+                number_of_children[k, m] = np.count_nonzero(scan_rs[lower:upper] > r[parent])
+        start = stop
+    return number_of_children
+
+
+def sweep_scan_data(scan_data, parameter_grid):
+    """
+    Returns a list with one dict for each combination of the values in parameter_grid, which maps the names in
+    multi_path.detector_parameters to lists of values. Parameters not in parameter_grid use the default value.
+    Each dict has the parameter values, and the number of parents, children and if it is a valid multi path, which are
+    the same as check_for_multi_path gives with those parameters.
+    """
+    defaults = multi_path.get_detector_parameters()
+    grid = {key: list(parameter_grid.get(key, [value])) for key, value in defaults.items()}
+    for key in parameter_grid:
+        if key not in defaults:
+            raise KeyError(f"Unknown detector parameter {key}")
+
+    r, theta = multi_path.polar_coordinates(scan_data.x, scan_data.y)
+    area = scan_data.area
+    candidates = np.flatnonzero((r < max(grid["lenght_from_origin_threshold"])) & (area > min(grid["cluster_area_threshold"])))
+    candidate_scans = np.searchsorted(scan_data.scan_offsets, candidates, side="right") - 1
+    number_of_children = count_children(scan_data, r, theta, candidates, grid["error_margin_degrees"])
+
+    rows = []
+    for lenght_from_origin_threshold, cluster_area_threshold in itertools.product(grid["lenght_from_origin_threshold"], grid["cluster_area_threshold"]):
+        is_parent = (r[candidates] < lenght_from_origin_threshold) & (area[candidates] > cluster_area_threshold)
+        parents = np.flatnonzero(is_parent)
+        if len(parents) == 0:
+            # No parents with these thresholds, so there are no children either
+            last_parents = parents
+            parents_per_scan = np.zeros(0, dtype=np.int64)
+        else:
+            parent_scans = candidate_scans[parents]
+            # As in check_for_multi_path, only the last parent of each scan is used, once for every parent in the scan
+            last_in_scan = np.append(parent_scans[1:] != parent_scans[:-1], True)
+            first_in_scan = np.insert(last_in_scan[:-1], 0, True)
+            parents_per_scan = np.flatnonzero(last_in_scan) - np.flatnonzero(first_in_scan) + 1
+            last_parents = parents[last_in_scan]
+
+        for m, error_margin_degrees in enumerate(grid["error_margin_degrees"]):
+            children_per_scan = number_of_children[last_parents, m]*parents_per_scan
+            number_of_parent_timestamps = int(np.count_nonzero(children_per_scan))
+            total_number_of_children = int(np.sum(children_per_scan))
+            for min_parent_timestamps in grid["min_parent_timestamps"]:
+                rows.append({"lenght_from_origin_threshold": lenght_from_origin_threshold,
+                             "cluster_area_threshold": cluster_area_threshold,
+                             "error_margin_degrees": error_margin_degrees,
+                             "min_parent_timestamps": min_parent_timestamps,
+                             "parents": number_of_parent_timestamps,
+                             "children": total_number_of_children,
+                             "multi_path": number_of_parent_timestamps > min_parent_timestamps})
+    return rows
+
+
+def sweep_file(file_path, parameter_grid, cache_dir=None):
+    if cache_dir is not None:
+        scan_data = scan_cache.load_scan_data(file_path, cache_dir)
+    else:
+        scan_data = import_data_from_json.import_scan_data(file_path)
+    rows = sweep_scan_data(scan_data, parameter_grid)
+    for row in rows:
+        row["filename"] = os.path.basename(file_path)
+    return rows
+
+
+def sweep_files(path_list, parameter_grid, cache_dir=None, number_of_workers=1):
+    """
+    Runs sweep_scan_data on all the files, using number_of_workers processes, and returns all the rows. If cache_dir
+    is given the parsed files are read from, or added to, the scan cache there.
+    """
+    rows = []
+    if number_of_workers == 1:
+        for file_path in path_list:
+            rows.extend(sweep_file(file_path, parameter_grid, cache_dir))
+        return rows
+
+    with ProcessPoolExecutor(max_workers=number_of_workers) as executor:
+        for file_rows in executor.map(sweep_file, path_list, itertools.repeat(parameter_grid), itertools.repeat(cache_dir)):
+            rows.extend(file_rows)
+    return rows
+
+
+def write_csv(rows, csv_filename):
+    columns = ["filename", "lenght_from_origin_threshold", "cluster_area_threshold", "error_margin_degrees",
+               "min_parent_timestamps", "parents", "children", "multi_path"]
+    with open(csv_filename, "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=columns)
+        writer.writeheader()
+        writer.writerows(rows)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check the files for multi path with every combination of the given "
+                                                 "detector parameters, and write the results to a CSV file")
+    parser.add_argument("paths", nargs="+", help="JSON files, or directories which are searched for JSON files")
+    for key, value in multi_path.detector_parameters.items():
+        parser.add_argument(f"--{key.replace('_', '-')}", dest=key, nargs="+", type=json.loads, metavar="VALUE",
+                            help=f"Values to sweep, default {value}")
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--cache-dir", help="Read the parsed files from, or add them to, the scan cache in this directory")
+    parser.add_argument("--output", default="parameter_sweep.csv")
+    args = parser.parse_args()
+
+    path_list = []
+    for path in args.paths:
+        if os.path.isdir(path):
+            path_list.extend(sorted(glob.glob(os.path.join(path, '**', '*.json'), recursive=True)))
+        else:
+            path_list.append(path)
+    parameter_grid = {key: getattr(args, key) for key in multi_path.detector_parameters if getattr(args, key) is not None}
+
+    rows = sweep_files(path_list, parameter_grid, args.cache_dir, args.workers)
+    write_csv(rows, args.output)
+    number_of_combinations = len(rows)//max(len(path_list), 1)
+    print(f"Swept {number_of_combinations} parameter combinations over {len(path_list)} files, saved to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -3,12 +3,28 @@ import numpy as np
 from matplotlib.colors import LinearSegmentedColormap
 import matplotlib.patches as mpatches
 import matplotlib.lines as mlines
+import matplotlib.image as mimage
+from scan_data import ScanData
+
+# The occupancy grids and the report renderers are only made once per process
+_occupancy_grids = {}
+_report_renderers = {}
+
+def load_occupancy_grids(work_dir):
+    """
+    Returns the two occupancy grids in npy_files, which are only loaded the first time
+    """
+    if work_dir not in _occupancy_grids:
+        data = np.load(f"{work_dir}/npy_files/occupancy_grid.npy",allow_pickle='TRUE').item()
+        data2 = np.load(f"{work_dir}/npy_files/occupancy_grid_without_dilating.npy", allow_pickle=True).item()
+        _occupancy_grids[work_dir] = (data, data2)
+    return _occupancy_grids[work_dir]
 
 def plot(work_dir):
     font_size_axis = 20
     font_size = 17
     fig, ax = plt.subplots(figsize=(11, 7.166666))
-    data = np.load(f"{work_dir}/npy_files/occupancy_grid.npy",allow_pickle='TRUE').item()
+    data, data2 = load_occupancy_grids(work_dir)
     occupancy_grid = data["occupancy_grid"]
     origin_x = data["origin_x"]
     origin_y = data["origin_y"]
@@ -23,8 +39,7 @@ def plot(work_dir):
     
     display_second_occupancy_grid = True
     if display_second_occupancy_grid:
-        # Load and display the second occupancy grid
-        data2 = np.load(f"{work_dir}/npy_files/occupancy_grid_without_dilating.npy", allow_pickle=True).item()
+        # Display the second occupancy grid
         occupancy_grid2 = data2["occupancy_grid"]
         
         # Second imshow with alpha for overlap effect
@@ -71,30 +86,91 @@ def plot(work_dir):
 
 
 def plot_measurements_in_background(measurement_dict,ax,origin_x=0,origin_y=0):
+    if isinstance(measurement_dict, ScanData):
+        # All measurements are drawn at once, with the color of the scan they belong to
+        color = measurement_dict.scan_colors[measurement_dict.scan_indices()]
+        ax.scatter(measurement_dict.x + origin_x, measurement_dict.y + origin_y, c=color)
+        return
+
+    # All measurements are drawn in one scatter, instead of one for each timestamp
+    x = []
+    y = []
+    color = []
     for timestamp, measurements in measurement_dict.items():
-        x = []
-        y = []
-        color = []
         for measurement in measurements:
             y.append(measurement[1] + origin_y)
             x.append(measurement[0] + origin_x)
             color.append(measurement[5])
-        ax.scatter(x, y, c=color)
+    ax.scatter(x, y, c=color)
 
 
-def plot_for_report(measurement_dict, multi_path_object, save_dir, filename, work_dir):
+class ReportRenderer:
+    """
+    Draws the report plots on a figure with the background from plot, which is only made once. The rendered background
+    is stored, so for each plot it is restored and only the measurements, the multi path and the legend are drawn on
+    top of it. These are removed again afterwards, so the figure can be reused for the next file.
+    """
+    def __init__(self, work_dir):
+        self.fig, self.ax, self.origin_x, self.origin_y = plot(work_dir)
+        self.fig.set_dpi(100)
 
-    fig, ax, origin_x, origin_y = plot(work_dir)
-    plot_measurements_in_background(measurement_dict, ax, origin_x, origin_y)
- 
-    multi_path_object.plot_multi_path(ax, origin_x, origin_y)
-    
-    image_patch_1 = mlines.Line2D([], [], color="#1f77b4", marker='o', linestyle='None', label='Multipath parents')
-    image_patch_2 = mpatches.Patch(color="#1f77b4" , label='Multipath parents cluster area', alpha=0.4)
-    dashed_line = mlines.Line2D([], [], color='#1f77b4', linestyle='dashed', label='Multipath sector')
-    image_patch_3 = mlines.Line2D([], [], color="#ff7f0e", marker='o', linestyle='None', label='Multipath childeren')
-    ax.legend(handles=[image_patch_1, image_patch_2, dashed_line, image_patch_3], loc='lower right', fontsize=17)
-
-    plt.savefig(f"{save_dir}/{filename[:-5]}.png",dpi=100)
-    plt.close()
-    print(f"Saved plot to {save_dir}/{filename[:-5]}.png")
\ No newline at end of file
+        image_patch_1 = mlines.Line2D([], [], color="#1f77b4", marker='o', linestyle='None', label='Multipath parents')
+        image_patch_2 = mpatches.Patch(color="#1f77b4" , label='Multipath parents cluster area', alpha=0.4)
+        dashed_line = mlines.Line2D([], [], color='#1f77b4', linestyle='dashed', label='Multipath sector')
+        image_patch_3 = mlines.Line2D([], [], color="#ff7f0e", marker='o', linestyle='None', label='Multipath childeren')
+        self.legend_handles = [image_patch_1, image_patch_2, dashed_line, image_patch_3]
+
+        # The radar marker and text are drawn above the measurements, so they are drawn again on top
+        self.background_artists = self.ax.get_children()
+        self.foreground_artists = [artist for artist in self.background_artists if artist.get_zorder() >= 10]
+        self.fig.canvas.draw()
+        self.can_blit = hasattr(self.fig.canvas, "copy_from_bbox")
+        if self.can_blit:
+            self.background = self.fig.canvas.copy_from_bbox(self.fig.bbox)
+
+    def draw(self, measurement_dict, multi_path_object):
+        """
+        Adds the measurements, multi path and legend to the axis, and returns the artists added
+        """
+        plot_measurements_in_background(measurement_dict, self.ax, self.origin_x, self.origin_y)
+        multi_path_object.plot_multi_path(self.ax, self.origin_x, self.origin_y)
+        self.ax.legend(handles=self.legend_handles, loc='lower right', fontsize=17)
+        background_ids = set(id(artist) for artist in self.background_artists)
+        return [artist for artist in self.ax.get_children() if id(artist) not in background_ids]
+
+    def render(self, measurement_dict, multi_path_object):
+        """
+        Returns the plot as an RGBA image array
+        """
+        artists = self.draw(measurement_dict, multi_path_object)
+        try:
+            if self.can_blit:
+                canvas = self.fig.canvas
+                canvas.restore_region(self.background)
+                for artist in sorted(artists, key=lambda artist: artist.get_zorder()) + self.foreground_artists:
+                    self.ax.draw_artist(artist)
+            else:
+                self.fig.canvas.draw()
+            return np.asarray(self.fig.canvas.buffer_rgba()).copy()
+        finally:
+            for artist in artists:
+                artist.remove()
+
+    def save(self, measurement_dict, multi_path_object, save_path):
+        save_png(self.render(measurement_dict, multi_path_object), save_path)
+
+
+def save_png(image, save_path):
+    mimage.imsave(save_path, image, dpi=100)
+
+
+def get_report_renderer(work_dir):
+    if work_dir not in _report_renderers:
+        _report_renderers[work_dir] = ReportRenderer(work_dir)
+    return _report_renderers[work_dir]
+
+
+def plot_for_report(measurement_dict, multi_path_object, save_dir, filename, work_dir):
+    renderer = get_report_renderer(work_dir)
+    renderer.save(measurement_dict, multi_path_object, f"{save_dir}/{filename[:-5]}.png")
+    print(f"Saved plot to {save_dir}/{filename[:-5]}.png")
@@ -0,0 +1,109 @@
+"""
+Script Title: Processing Manifest
+Description: This script contains a manifest of the files that have been processed, stored in a SQLite database. For each
+file the size, modification time, content hash, detector parameters and the outcome (multi path or not) are recorded,
+so a rerun over the archive only processes the files that are new, have been modified, or were processed with other
+detector parameters. A file whose size or modification time has changed but whose content hash is the same, e.g. after
+being copied, is not processed again.
+"""
+
+import os
+import json
+import sqlite3
+import hashlib
+import datetime
+import multi_path
+
+
+def content_hash(file_path, chunk_size=2**20):
+    file_hash = hashlib.sha256()
+    with open(file_path, "rb") as file:
+        for chunk in iter(lambda: file.read(chunk_size), b""):
+            file_hash.update(chunk)
+    return file_hash.hexdigest()
+
+
+def file_state(file_path):
+    """
+    Returns the size, modification time and content hash of the file, as recorded in the manifest. The workers of a batch
+    run call this, so the files are hashed in parallel instead of in the process that records them.
+    """
+    stat = os.stat(file_path)
+    return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "content_hash": content_hash(file_path)}
+
+
+class ProcessingManifest:
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self.connection = sqlite3.connect(db_path, timeout=60)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        with self.connection:
+            self.connection.execute("""
+                CREATE TABLE IF NOT EXISTS processed_files (
+                    file_path TEXT PRIMARY KEY,
+                    size INTEGER,
+                    mtime_ns INTEGER,
+                    content_hash TEXT,
+                    parameters TEXT,
+                    multi_path INTEGER,
+                    number_of_parents INTEGER,
+                    number_of_children INTEGER,
+                    processed_time TEXT
+                )""")
+
+    def needs_processing(self, file_path, parameters=None):
+        """
+        Returns True if the file is not in the manifest, has changed, or was processed with other detector parameters.
+        parameters are the overrides of multi_path.detector_parameters used for this run.
+        """
+        row = self.connection.execute(
+            "SELECT size, mtime_ns, content_hash, parameters FROM processed_files WHERE file_path = ?",
+            (os.path.abspath(file_path),)).fetchone()
+        if row is None:
+            return True
+        size, mtime_ns, stored_hash, stored_parameters = row
+        if json.loads(stored_parameters) != multi_path.get_detector_parameters(parameters):
+            return True
+
+        stat = os.stat(file_path)
+        if stat.st_size == size and stat.st_mtime_ns == mtime_ns:
+            return False
+        # Only hash the file when the size or modification time has changed
+        if stat.st_size == size and content_hash(file_path) == stored_hash:
+            with self.connection:
+                self.connection.execute("UPDATE processed_files SET mtime_ns = ? WHERE file_path = ?",
+                                        (stat.st_mtime_ns, os.path.abspath(file_path)))
+            return False
+        return True
+
+    def files_to_process(self, path_list, parameters=None):
+        return [file_path for file_path in path_list if self.needs_processing(file_path, parameters)]
+
+    def record(self, result):
+        """
+        Records a processed file from a batch_processing result. The file is only hashed here if the result does not
+        have its file_state already.
+        """
+        file_path = os.path.abspath(result["file_path"])
+        state = result.get("file_state") or file_state(file_path)
+        with self.connection:
+            self.connection.execute("INSERT OR REPLACE INTO processed_files VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (file_path, state["size"], state["mtime_ns"], state["content_hash"],
+                 json.dumps(result["thresholds"], sort_keys=True), int(result["multi_path"]),
+                 result["parents"], result["children"], datetime.datetime.now().isoformat(timespec="seconds")))
+
+    def get(self, file_path):
+        cursor = self.connection.execute("SELECT * FROM processed_files WHERE file_path = ?", (os.path.abspath(file_path),))
+        row = cursor.fetchone()
+        if row is None:
+            return None
+        processed_file = dict(zip([column[0] for column in cursor.description], row))
+        processed_file["parameters"] = json.loads(processed_file["parameters"])
+        processed_file["multi_path"] = bool(processed_file["multi_path"])
+        return processed_file
+
+    def close(self):
+        self.connection.close()
+
+    def __len__(self):
+        return self.connection.execute("SELECT COUNT(*) FROM processed_files").fetchone()[0]
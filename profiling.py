@@ -0,0 +1,220 @@
+"""
+Script Title: Profiling
+Description: This script contains the timing of the stages of the pipeline (parse, detection, colour scaling, tracking,
+filtering, conversion and plotting). For each file and stage the wall time, the number of measurements or tracks
+handled, and the peak memory are recorded, and the run is summed up per stage. The report can be saved as JSON or CSV.
+The peak memory is the maximum resident size of the process, and with trace_memory=True also the peak traced by
+tracemalloc during the stage, which is started for each file and stopped again after it. With cprofile_dir set, each file
+is also run under cProfile and the stats are saved there as {filename}.{pid}.prof, so the analysis in a worker process and
+the plotting in the main process do not overwrite each other. They can be read together with pstats.Stats(*paths).
+When profiling is off, null_profiler is used, which does nothing, so the overhead is a couple of function calls per stage.
+"""
+
+import os
+import csv
+import json
+import time
+import pstats
+import cProfile
+import tracemalloc
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:
+    # Not available on Windows
+    resource = None
+
+
+def max_rss():
+    """
+    Returns the maximum resident size of the process in bytes, or None
+    """
+    if resource is None:
+        return None
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss*1024
+
+
+class Profiler:
+    def __init__(self, trace_memory=False, cprofile_dir=None):
+        self.trace_memory = trace_memory
+        self.cprofile_dir = cprofile_dir
+        self.files = {}             # file_path -> record of the file, in the order they were started
+        self.current_file = None
+        self.cprofile_paths = {}    # file_path -> the cProfile stats saved by this profiler
+
+    def settings(self):
+        """
+        Returns the arguments for making a Profiler with the same settings, e.g. in a worker process
+        """
+        return {"trace_memory": self.trace_memory, "cprofile_dir": self.cprofile_dir}
+
+    @contextmanager
+    def file(self, file_path):
+        """
+        The stages run inside this are recorded for file_path. A file can be entered again, e.g. for plotting after
+        the analysis, and the stages are then added to the same record. The stats of cProfile are added to the stats
+        saved when the file was entered before in the same process.
+        """
+        record = self.files.setdefault(file_path, {"file_path": file_path, "time": 0.0, "stages": []})
+        previous_file = self.current_file
+        self.current_file = record
+        started_tracing = self.trace_memory and not tracemalloc.is_tracing()
+        if started_tracing:
+            tracemalloc.start()
+        profile = None
+        # Only the outermost file is run under cProfile, as only one profiler can be active at a time
+        if self.cprofile_dir is not None and previous_file is None:
+            profile = cProfile.Profile()
+            profile.enable()
+        start_time = time.perf_counter()
+        try:
+            yield record
+        finally:
+            record["time"] += time.perf_counter() - start_time
+            if profile is not None:
+                profile.disable()
+                self._save_cprofile(profile, file_path)
+            if started_tracing:
+                tracemalloc.stop()
+            self.current_file = previous_file
+
+    def _save_cprofile(self, profile, file_path):
+        os.makedirs(self.cprofile_dir, exist_ok=True)
+        prof_path = os.path.join(self.cprofile_dir, f"{os.path.basename(file_path)}.{os.getpid()}.prof")
+        if file_path in self.cprofile_paths:
+            stats = pstats.Stats(self.cprofile_paths[file_path])
+            stats.add(profile)
+            stats.dump_stats(prof_path)
+        else:
+            profile.dump_stats(prof_path)
+        self.cprofile_paths[file_path] = prof_path
+
+    @contextmanager
+    def stage(self, name):
+        """
+        Times the code inside it as the stage name of the current file. The stage record is returned, so the count
+        of measurements or tracks can be set in it.
+        """
+        stage = {"stage": name, "time": None, "count": None, "peak_memory": None, "max_rss": None}
+        if self.current_file is not None:
+            self.current_file["stages"].append(stage)
+        if self.trace_memory and tracemalloc.is_tracing():
+            tracemalloc.reset_peak()
+        start_time = time.perf_counter()
+        try:
+            yield stage
+        finally:
+            stage["time"] = time.perf_counter() - start_time
+            if self.trace_memory and tracemalloc.is_tracing():
+                stage["peak_memory"] = tracemalloc.get_traced_memory()[1]
+            stage["max_rss"] = max_rss()
+
+    def add_file_record(self, record):
+        """
+        Adds the record of a file profiled somewhere else, e.g. in a worker process
+        """
+        if record is None:
+            return
+        if record["file_path"] in self.files:
+            existing = self.files[record["file_path"]]
+            existing["time"] += record["time"]
+            existing["stages"].extend(record["stages"])
+        else:
+            self.files[record["file_path"]] = record
+
+    def file_record(self, file_path):
+        return self.files.get(file_path)
+
+    def summary(self):
+        """
+        Returns a dict with the total, mean and max time, the total count and the max peak memory of each stage
+        """
+        stages = {}
+        for record in self.files.values():
+            for stage in record["stages"]:
+                total = stages.setdefault(stage["stage"], {"number_of_files": 0, "total_time": 0.0, "max_time": 0.0,
+                                                           "total_count": 0, "peak_memory": None, "max_rss": None})
+                total["number_of_files"] += 1
+                total["total_time"] += stage["time"]
+                total["max_time"] = max(total["max_time"], stage["time"])
+                if stage["count"] is not None:
+                    total["total_count"] += stage["count"]
+                for key in ("peak_memory", "max_rss"):
+                    if stage[key] is not None:
+                        total[key] = max(total[key] or 0, stage[key])
+        for total in stages.values():
+            total["mean_time"] = total["total_time"]/total["number_of_files"]
+        return {"number_of_files": len(self.files), "total_time": sum(record["time"] for record in self.files.values()),
+                "stages": stages}
+
+    def report(self):
+        return {"files": list(self.files.values()), "run": self.summary()}
+
+    def save_json(self, json_filename):
+        with open(json_filename, "w") as f:
+            json.dump(self.report(), f, indent=2)
+
+    def save_csv(self, csv_filename):
+        """
+        Writes one row for each stage of each file
+        """
+        columns = ["file_path", "stage", "time", "count", "peak_memory", "max_rss"]
+        with open(csv_filename, "w", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=columns)
+            writer.writeheader()
+            for record in self.files.values():
+                for stage in record["stages"]:
+                    writer.writerow({"file_path": record["file_path"], **stage})
+
+    def print_summary(self):
+        summary = self.summary()
+        print(f"Profiled {summary['number_of_files']} files in {summary['total_time']:.2f} s")
+        print(f"{'stage':<14}{'files':>7}{'total [s]':>11}{'mean [s]':>10}{'max [s]':>10}{'count':>12}")
+        for name, total in summary["stages"].items():
+            print(f"{name:<14}{total['number_of_files']:>7}{total['total_time']:>11.3f}{total['mean_time']:>10.4f}"
+                  f"{total['max_time']:>10.4f}{total['total_count']:>12}")
+
+
+class _NullContext:
+    def __enter__(self):
+        # A throwaway record, so the callers can set the count without checking if profiling is on
+        return {}
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+class NullProfiler:
+    """
+    Has the same methods as Profiler for the pipeline, but records nothing
+    """
+    _context = _NullContext()
+
+    def settings(self):
+        return None
+
+    def file(self, file_path):
+        return self._context
+
+    def stage(self, name):
+        return self._context
+
+    def add_file_record(self, record):
+        pass
+
+    def file_record(self, file_path):
+        return None
+
+
+null_profiler = NullProfiler()
+
+
+def make_profiler(settings):
+    """
+    Returns a Profiler made from Profiler.settings(), or null_profiler if settings is None
+    """
+    if settings is None:
+        return null_profiler
+    return Profiler(**settings)
@@ -0,0 +1,91 @@
+"""
+Script Title: Scan Cache
+Description: This script contains an on-disk cache of parsed radar files. The scans of each JSON file are stored as a
+ScanData in an uncompressed .npz file, keyed by the path, size and modification time of the file and the parser version,
+so a file is only parsed again if it, or the parsing, has changed. When the cache grows above max_cache_size bytes, the
+least recently used files are removed.
+"""
+
+import os
+import glob
+import hashlib
+import zipfile
+import import_data_from_json
+from scan_data import ScanData
+
+default_max_cache_size = 10*1024**3
+
+
+def default_cache_dir(work_dir):
+    return os.path.join(work_dir, "scan_cache")
+
+
+def cache_key(file_path):
+    stat = os.stat(file_path)
+    key = f"{os.path.abspath(file_path)}|{stat.st_size}|{stat.st_mtime_ns}|{import_data_from_json.PARSER_VERSION}"
+    return hashlib.sha1(key.encode()).hexdigest()
+
+
+def cache_path(file_path, cache_dir):
+    filename = os.path.splitext(os.path.basename(file_path))[0]
+    return os.path.join(cache_dir, f"{filename}_{cache_key(file_path)}.npz")
+
+
+def load_scan_data(file_path, cache_dir, max_cache_size=default_max_cache_size):
+    """
+    Returns the ScanData of the file from the cache, or parses the file and adds it to the cache
+    """
+    path = cache_path(file_path, cache_dir)
+    if os.path.exists(path):
+        try:
+            scan_data = ScanData.load(path)
+            # The modification time is used to find the least recently used files
+            os.utime(path)
+            return scan_data
+        except (OSError, ValueError, KeyError, zipfile.BadZipFile):
+            # E.g. a file from a run that was stopped while writing, it is parsed again below
+            remove_file(path)
+
+    scan_data = import_data_from_json.import_scan_data(file_path)
+
+    os.makedirs(cache_dir, exist_ok=True)
+    # Write to a temporary file first, so other processes never read a half written file
+    temporary_path = f"{path}.{os.getpid()}.tmp"
+    with open(temporary_path, "wb") as file:
+        scan_data.save(file)
+    os.replace(temporary_path, path)
+
+    evict_cache(cache_dir, max_cache_size)
+    return scan_data
+
+
+def evict_cache(cache_dir, max_cache_size=default_max_cache_size):
+    """
+    Removes the least recently used files until the cache is smaller than max_cache_size bytes
+    """
+    files = []
+    for path in glob.glob(os.path.join(cache_dir, "*.npz")):
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            continue
+        files.append((stat.st_mtime, stat.st_size, path))
+
+    cache_size = sum(size for _, size, _ in files)
+    for _, size, path in sorted(files):
+        if cache_size <= max_cache_size:
+            break
+        remove_file(path)
+        cache_size -= size
+
+
+def clear_cache(cache_dir):
+    evict_cache(cache_dir, 0)
+
+
+def remove_file(path):
+    # Another process might have removed the file already
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
@@ -0,0 +1,198 @@
+"""
+Script Title: Scan Data
+Description: This script contains the ScanData class, which stores the radar measurements in flat NumPy arrays instead of
+the nested lists used by the measurement_dict. The measurements of all scans are stored after each other, and the
+scan_offsets array gives where each scan starts. The hull vertices of all measurements are stored the same way, with
+hull_offsets giving where the polygon of each measurement starts.
+ScanData can also be used as the old measurement_dict, since it has keys(), items() and [timestamp] which return the
+measurements as [x,y,area,polygon_xs,polygon_ys] lists.
+"""
+
+import numpy as np
+
+
+class ScanData:
+    def __init__(self, timestamps, scan_offsets, x, y, area, hull_offsets, hull_xs, hull_ys):
+        self.timestamps = timestamps        # One timestamp per scan
+        self.scan_offsets = scan_offsets    # Index of the first measurement of each scan, and the total number last
+        self.x = x
+        self.y = y
+        self.area = area
+        self.hull_offsets = hull_offsets    # Index of the first hull vertex of each measurement, and the total number last
+        self.hull_xs = hull_xs
+        self.hull_ys = hull_ys
+        self.scan_colors = None             # RGBA color of each scan, set by utilities.add_color_scaling
+        self._scan_index_by_timestamp = None
+
+    @classmethod
+    def from_scans(cls, scans):
+        """
+        Creates the ScanData from an iterable of (timestamp, measurements) pairs, e.g. import_data_from_json.iterate_scans
+        """
+        timestamps = []
+        scan_offsets = [0]
+        x = []
+        y = []
+        area = []
+        hull_offsets = [0]
+        hull_xs = []
+        hull_ys = []
+        for timestamp, measurements in scans:
+            if timestamp == "Timestamp" or timestamp == "Info":
+                continue
+            timestamps.append(timestamp)
+            for measurement in measurements:
+                x.append(measurement[0])
+                y.append(measurement[1])
+                area.append(measurement[2])
+                hull_xs.extend(measurement[3])
+                hull_ys.extend(measurement[4])
+                hull_offsets.append(len(hull_xs))
+            scan_offsets.append(len(x))
+
+        return cls(np.array(timestamps, dtype=np.float64), np.array(scan_offsets, dtype=np.int64),
+                   np.array(x, dtype=np.float64), np.array(y, dtype=np.float64), np.array(area, dtype=np.float64),
+                   np.array(hull_offsets, dtype=np.int64), np.array(hull_xs, dtype=np.float64),
+                   np.array(hull_ys, dtype=np.float64))
+
+    @classmethod
+    def from_measurement_dict(cls, measurement_dict):
+        return cls.from_scans(measurement_dict.items())
+
+    @classmethod
+    def load(cls, file):
+        """
+        Loads a ScanData saved with save
+        """
+        with np.load(file) as data:
+            return cls(data["timestamps"], data["scan_offsets"], data["x"], data["y"], data["area"],
+                       data["hull_offsets"], data["hull_xs"], data["hull_ys"])
+
+    def save(self, file):
+        """
+        Saves the arrays to an uncompressed .npz file, file can be a filename or an open binary file
+        """
+        np.savez(file, timestamps=self.timestamps, scan_offsets=self.scan_offsets, x=self.x, y=self.y, area=self.area,
+                 hull_offsets=self.hull_offsets, hull_xs=self.hull_xs, hull_ys=self.hull_ys)
+
+    def to_measurement_dict(self):
+        measurement_dict = {}
+        for timestamp, measurements in self.items():
+            measurement_dict[timestamp] = measurements
+        return measurement_dict
+
+    def number_of_scans(self):
+        return len(self.timestamps)
+
+    def number_of_measurements(self):
+        return len(self.x)
+
+    def scan_slice(self, scan_index):
+        return slice(int(self.scan_offsets[scan_index]), int(self.scan_offsets[scan_index + 1]))
+
+    def scan_indices(self):
+        """
+        Returns the scan index of every measurement
+        """
+        return np.repeat(np.arange(self.number_of_scans()), np.diff(self.scan_offsets))
+
+    def measurement_timestamps(self):
+        """
+        Returns the timestamp of every measurement
+        """
+        return np.repeat(self.timestamps, np.diff(self.scan_offsets))
+
+    def time_window(self, start_time=None, end_time=None):
+        """
+        Returns a ScanData with the scans with start_time <= timestamp <= end_time. The timestamps are sorted, so the
+        window is found with a binary search, and the measurement and hull arrays of the result are views into these.
+        """
+        first_scan = 0 if start_time is None else int(np.searchsorted(self.timestamps, start_time, side="left"))
+        last_scan = self.number_of_scans() if end_time is None else int(np.searchsorted(self.timestamps, end_time, side="right"))
+        last_scan = max(first_scan, last_scan)
+
+        first_measurement = int(self.scan_offsets[first_scan])
+        last_measurement = int(self.scan_offsets[last_scan])
+        first_vertex = int(self.hull_offsets[first_measurement])
+        last_vertex = int(self.hull_offsets[last_measurement])
+
+        window = ScanData(self.timestamps[first_scan:last_scan],
+                          self.scan_offsets[first_scan:last_scan + 1] - first_measurement,
+                          self.x[first_measurement:last_measurement],
+                          self.y[first_measurement:last_measurement],
+                          self.area[first_measurement:last_measurement],
+                          self.hull_offsets[first_measurement:last_measurement + 1] - first_vertex,
+                          self.hull_xs[first_vertex:last_vertex],
+                          self.hull_ys[first_vertex:last_vertex])
+        if self.scan_colors is not None:
+            window.scan_colors = self.scan_colors[first_scan:last_scan]
+        return window
+
+    def select(self, indices):
+        """
+        Returns a ScanData with only the measurements with the given indices. Scans without any of the measurements are
+        left out.
+        """
+        indices = np.sort(np.asarray(indices, dtype=np.int64))
+        scan_indices = np.searchsorted(self.scan_offsets, indices, side="right") - 1
+        scans, measurements_per_scan = np.unique(scan_indices, return_counts=True)
+
+        hull_lengths = np.diff(self.hull_offsets)[indices]
+        hull_offsets = np.concatenate(([0], np.cumsum(hull_lengths)))
+        vertex_indices = np.repeat(self.hull_offsets[indices] - hull_offsets[:-1], hull_lengths) + np.arange(hull_offsets[-1])
+
+        selection = ScanData(self.timestamps[scans], np.concatenate(([0], np.cumsum(measurements_per_scan))),
+                             self.x[indices], self.y[indices], self.area[indices],
+                             hull_offsets, self.hull_xs[vertex_indices], self.hull_ys[vertex_indices])
+        if self.scan_colors is not None:
+            selection.scan_colors = self.scan_colors[scans]
+        return selection
+
+    def measurement(self, index):
+        """
+        Returns measurement number index as a [x,y,area,polygon_xs,polygon_ys] list, like in the measurement_dict
+        """
+        hull = slice(int(self.hull_offsets[index]), int(self.hull_offsets[index + 1]))
+        return [float(self.x[index]), float(self.y[index]), float(self.area[index]),
+                self.hull_xs[hull].tolist(), self.hull_ys[hull].tolist()]
+
+    def scan_measurements(self, scan_index):
+        measurements = []
+        scan = self.scan_slice(scan_index)
+        for index in range(scan.start, scan.stop):
+            measurement = self.measurement(index)
+            if self.scan_colors is not None:
+                measurement.append(self.scan_colors[scan_index])
+            measurements.append(measurement)
+        return measurements
+
+    # The methods below lets ScanData be used in place of the measurement_dict
+    def keys(self):
+        return self.timestamps.tolist()
+
+    def items(self):
+        for scan_index, timestamp in enumerate(self.timestamps.tolist()):
+            yield timestamp, self.scan_measurements(scan_index)
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self):
+        return self.number_of_scans()
+
+    def __contains__(self, timestamp):
+        return self.scan_index(timestamp) is not None
+
+    def scan_index(self, timestamp):
+        if self._scan_index_by_timestamp is None:
+            self._scan_index_by_timestamp = {timestamp: k for k, timestamp in enumerate(self.timestamps.tolist())}
+        return self._scan_index_by_timestamp.get(timestamp)
+
+    def __getitem__(self, timestamp):
+        scan_index = self.scan_index(timestamp)
+        if scan_index is None:
+            raise KeyError(timestamp)
+        return self.scan_measurements(scan_index)
+
+    def __repr__(self) -> str:
+        return f"ScanData with {self.number_of_scans()} scans and {self.number_of_measurements()} measurements"
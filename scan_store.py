@@ -0,0 +1,56 @@
+"""
+Script Title: Scan Store
+Description: This script contains a scan store, a directory with one .npy file for each of the arrays of a ScanData.
+The store is made once from a JSON file (import_data_from_json.convert_json_to_scan_store), and then opened with the
+arrays memory-mapped, so processes reading the same capture share one copy of it through the page cache, and only the
+parts that are used are read from disk. Slicing a time window out of the store with ScanData.time_window does not copy
+the measurements.
+"""
+
+import os
+import json
+import numpy as np
+from scan_data import ScanData
+
+array_names = ["timestamps", "scan_offsets", "x", "y", "area", "hull_offsets", "hull_xs", "hull_ys"]
+array_dtypes = {"timestamps": np.float64, "scan_offsets": np.int64, "x": np.float64, "y": np.float64, "area": np.float64,
+                "hull_offsets": np.int64, "hull_xs": np.float64, "hull_ys": np.float64}
+store_version = 1
+
+
+def write_scan_store(scan_data, store_dir, source_file=None):
+    """
+    Writes the arrays of scan_data to store_dir
+    """
+    os.makedirs(store_dir, exist_ok=True)
+    info_path = os.path.join(store_dir, "info.json")
+    if os.path.exists(info_path):
+        os.remove(info_path)
+    for name in array_names:
+        np.save(os.path.join(store_dir, f"{name}.npy"), np.ascontiguousarray(getattr(scan_data, name), dtype=array_dtypes[name]))
+
+    # The info file is written last, so a store without it is not complete
+    info = {"version": store_version, "source_file": source_file,
+            "number_of_scans": scan_data.number_of_scans(), "number_of_measurements": scan_data.number_of_measurements()}
+    with open(info_path, "w") as file:
+        json.dump(info, file)
+
+
+def is_scan_store(store_dir):
+    return os.path.exists(os.path.join(store_dir, "info.json"))
+
+
+def open_scan_store(store_dir):
+    """
+    Opens the store with all the arrays memory-mapped read only
+    """
+    with open(os.path.join(store_dir, "info.json"), "r") as file:
+        info = json.load(file)
+    if info["version"] != store_version:
+        raise ValueError(f"Scan store {store_dir} has version {info['version']}, expected {store_version}")
+
+    arrays = {}
+    for name in array_names:
+        arrays[name] = np.load(os.path.join(store_dir, f"{name}.npy"), mmap_mode="r")
+    return ScanData(**arrays)
+
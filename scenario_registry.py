@@ -0,0 +1,175 @@
+"""
+Script Title: Scenario Registry
+Description: This script contains a registry of the files with multi path scenarios, stored in a SQLite database. It
+replaces reading and appending to multi_path_scenarios.txt: inserts are atomic, so parallel runs can add files at the
+same time, and the filename and recording time are indexed, so lookups do not read the whole list. For each file the
+number of parents and children, the number of children over land (when checked with a land mask), the parent timestamps
+and the detector thresholds used are stored.
+The registry can be exported to, and imported from, the txt format.
+"""
+
+import os
+import re
+import glob
+import json
+import sqlite3
+import datetime
+
+
+class ScenarioRegistry:
+    def __init__(self, db_path):
+        self.db_path = db_path
+        # A long timeout, so parallel writers wait for each other instead of failing
+        self.connection = sqlite3.connect(db_path, timeout=60)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        with self.connection:
+            self.connection.execute("""
+                CREATE TABLE IF NOT EXISTS scenarios (
+                    filename TEXT PRIMARY KEY,
+                    file_path TEXT,
+                    recording_time TEXT,
+                    number_of_parents INTEGER,
+                    number_of_children INTEGER,
+                    parent_timestamps TEXT,
+                    thresholds TEXT,
+                    added_time TEXT,
+                    number_of_children_over_land INTEGER
+                )""")
+            # Registries made before the land mask was added do not have the column
+            columns = [row[1] for row in self.connection.execute("PRAGMA table_info(scenarios)")]
+            if "number_of_children_over_land" not in columns:
+                self.connection.execute("ALTER TABLE scenarios ADD COLUMN number_of_children_over_land INTEGER")
+            self.connection.execute("CREATE INDEX IF NOT EXISTS scenarios_recording_time ON scenarios (recording_time)")
+
+    def add(self, file_path, number_of_parents=None, number_of_children=None, parent_timestamps=None, thresholds=None,
+            number_of_children_over_land=None):
+        """
+        Adds the file, or updates it if it is already in the registry. Values that are None are left unchanged, except
+        number_of_children_over_land, which is cleared when the thresholds or the number of children change.
+        """
+        filename = os.path.basename(file_path)
+        # A bare filename, e.g. from multi_path_scenarios.txt, does not tell where the file is
+        stored_path = os.path.abspath(file_path) if os.path.dirname(file_path) or os.path.exists(file_path) else None
+        if parent_timestamps is not None:
+            parent_timestamps = json.dumps([float(timestamp) for timestamp in parent_timestamps])
+        if thresholds is not None:
+            thresholds = json.dumps(thresholds, sort_keys=True)
+
+        with self.connection:
+            self.connection.execute("""
+                INSERT INTO scenarios VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT (filename) DO UPDATE SET
+                    file_path = COALESCE(excluded.file_path, file_path),
+                    number_of_parents = COALESCE(excluded.number_of_parents, number_of_parents),
+                    number_of_children = COALESCE(excluded.number_of_children, number_of_children),
+                    parent_timestamps = COALESCE(excluded.parent_timestamps, parent_timestamps),
+                    thresholds = COALESCE(excluded.thresholds, thresholds),
+                    number_of_children_over_land = CASE
+                        WHEN excluded.number_of_children_over_land IS NOT NULL THEN excluded.number_of_children_over_land
+                        -- A count from a run with other thresholds, or on other children, no longer matches the row
+                        WHEN (excluded.thresholds IS NOT NULL AND excluded.thresholds IS NOT thresholds)
+                            OR (excluded.number_of_children IS NOT NULL AND excluded.number_of_children IS NOT number_of_children)
+                            THEN NULL
+                        ELSE number_of_children_over_land END""",
+                (filename, stored_path, recording_time(filename),
+                 number_of_parents, number_of_children, parent_timestamps, thresholds,
+                 datetime.datetime.now().isoformat(timespec="seconds"), number_of_children_over_land))
+
+    def add_result(self, result):
+        """
+        Adds a file with multi path from a batch_processing result
+        """
+        self.add(result["file_path"], result["parents"], result["children"], result["parent_timestamps"], result["thresholds"],
+                 result.get("children_over_land"))
+
+    def contains(self, filename):
+        row = self.connection.execute("SELECT 1 FROM scenarios WHERE filename = ?", (os.path.basename(filename),)).fetchone()
+        return row is not None
+
+    def get(self, filename):
+        """
+        Returns the stored information about the file as a dict, or None if it is not in the registry
+        """
+        cursor = self.connection.execute("SELECT * FROM scenarios WHERE filename = ?", (os.path.basename(filename),))
+        row = cursor.fetchone()
+        if row is None:
+            return None
+        return self._row_to_dict(cursor, row)
+
+    def find_by_date(self, start, end):
+        """
+        Returns the files recorded between start and end, given as datetime objects or ISO strings
+        """
+        if isinstance(start, datetime.datetime):
+            start = start.isoformat()
+        if isinstance(end, datetime.datetime):
+            end = end.isoformat()
+        cursor = self.connection.execute(
+            "SELECT * FROM scenarios WHERE recording_time >= ? AND recording_time <= ? ORDER BY recording_time", (start, end))
+        return [self._row_to_dict(cursor, row) for row in cursor.fetchall()]
+
+    def filenames(self):
+        return [row[0] for row in self.connection.execute("SELECT filename FROM scenarios ORDER BY rowid")]
+
+    def find_files(self, root):
+        """
+        Returns the paths of the files in the registry. Files without a stored path are searched for in the
+        subdirectories of root, like utilities.find_files.
+        """
+        path_list = []
+        missing = set()
+        for filename, file_path in self.connection.execute("SELECT filename, file_path FROM scenarios ORDER BY rowid"):
+            if file_path is not None and os.path.exists(file_path):
+                path_list.append(file_path)
+            else:
+                missing.add(filename)
+
+        if missing:
+            for item in os.listdir(root):
+                for file in glob.glob(os.path.join(root, item, '*.json')):
+                    if os.path.basename(file) in missing:
+                        path_list.append(file)
+                        self.add(file)
+        return path_list
+
+    def export_txt(self, txt_filename):
+        """
+        Writes the filenames to txt_filename in the format of multi_path_scenarios.txt
+        """
+        with open(txt_filename, "w") as f:
+            for filename in self.filenames():
+                f.write(filename + "\n")
+
+    def import_txt(self, txt_filename):
+        """
+        Adds the filenames in txt_filename, in the format of multi_path_scenarios.txt
+        """
+        with open(txt_filename, "r") as f:
+            for line in f:
+                if line.strip():
+                    self.add(line.strip())
+
+    def close(self):
+        self.connection.close()
+
+    def __len__(self):
+        return self.connection.execute("SELECT COUNT(*) FROM scenarios").fetchone()[0]
+
+    @staticmethod
+    def _row_to_dict(cursor, row):
+        scenario = dict(zip([column[0] for column in cursor.description], row))
+        for key in ("parent_timestamps", "thresholds"):
+            if scenario[key] is not None:
+                scenario[key] = json.loads(scenario[key])
+        return scenario
+
+
+def recording_time(filename):
+    """
+    Returns the recording time in a rosbag_2023-09-17-12-12-38.json filename as an ISO string, or None
+    """
+    match = re.search(r"(\d{4})-(\d{2})-(\d{2})-(\d{2})-(\d{2})-(\d{2})", filename)
+    if match is None:
+        return None
+    year, month, day, hour, minute, second = match.groups()
+    return f"{year}-{month}-{day}T{hour}:{minute}:{second}"
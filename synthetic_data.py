@@ -0,0 +1,80 @@
+"""
+Script Title: Synthetic Data
+Description: This script generates synthetic radar recordings in the same JSON format as the rosbag files, with
+header.stamp and a scan list of clusters with type, cluster_centroid, area and hull.points. The number of scans,
+clusters per scan and points per hull can be chosen, and multi path can be injected: every multi_path_every scans a
+large cluster close to the radar is added, with smaller clusters further out in the same direction. The other clusters
+are smaller than the cluster_area_threshold, so they do not give multi path on their own.
+Like in the rosbag files, cluster_centroid.x is north and cluster_centroid.y is east.
+"""
+
+import json
+import numpy as np
+import multi_path
+
+
+def make_cluster(rng, x, y, area, points_per_hull, cluster_type=3):
+    """
+    Returns a cluster at east x and north y, with a hull of points_per_hull points around it
+    """
+    radius = np.sqrt(area/np.pi)
+    angles = np.sort(rng.uniform(0, 2*np.pi, points_per_hull))
+    radii = radius*rng.uniform(0.7, 1.3, points_per_hull)
+    points = [{"x": float(y + r*np.sin(angle)), "y": float(x + r*np.cos(angle)), "z": 0.0} for angle, r in zip(angles, radii)]
+    return {"type": cluster_type, "cluster_centroid": {"x": float(y), "y": float(x), "z": 0.0}, "area": float(area),
+            "hull": {"points": points}}
+
+
+def make_multi_path_clusters(rng, points_per_hull, children_per_parent):
+    """
+    Returns a parent cluster which satisfies the default detector_parameters, and children_per_parent clusters in its sector
+    """
+    parameters = multi_path.detector_parameters
+    error_margin = np.deg2rad(parameters["error_margin_degrees"])
+    parent_r = rng.uniform(10, 0.9*parameters["lenght_from_origin_threshold"])
+    parent_theta = rng.uniform(-np.pi, np.pi)
+    parent_area = rng.uniform(1.2, 2.5)*parameters["cluster_area_threshold"]
+    clusters = [make_cluster(rng, parent_r*np.cos(parent_theta), parent_r*np.sin(parent_theta), parent_area, points_per_hull)]
+    for _ in range(children_per_parent):
+        child_r = parent_r + rng.uniform(10, 60)
+        child_theta = parent_theta + rng.uniform(-0.5, 0.5)*error_margin
+        clusters.append(make_cluster(rng, child_r*np.cos(child_theta), child_r*np.sin(child_theta), rng.uniform(5, 50), points_per_hull))
+    return clusters
+
+
+def generate_scans(number_of_scans=200, clusters_per_scan=20, points_per_hull=8, multi_path_every=0,
+                   children_per_parent=2, other_type_fraction=0.1, scan_period=0.5, start_time=1692370377.0, seed=0):
+    """
+    Yields the scans one at a time as dicts in the rosbag format. multi_path_every=0 gives no multi path, and
+    other_type_fraction is the share of clusters that are not type 3, which the import skips.
+    """
+    rng = np.random.default_rng(seed)
+    max_range = 130
+    for k in range(number_of_scans):
+        r = rng.uniform(5, max_range, clusters_per_scan)
+        theta = rng.uniform(-np.pi, np.pi, clusters_per_scan)
+        areas = rng.uniform(5, 0.9*multi_path.detector_parameters["cluster_area_threshold"], clusters_per_scan)
+        types = np.where(rng.uniform(size=clusters_per_scan) < other_type_fraction, 1, 3)
+        scan = [make_cluster(rng, r[i]*np.cos(theta[i]), r[i]*np.sin(theta[i]), areas[i], points_per_hull, int(types[i]))
+                for i in range(clusters_per_scan)]
+        if multi_path_every and k % multi_path_every == 0:
+            scan.extend(make_multi_path_clusters(rng, points_per_hull, children_per_parent))
+
+        timestamp = start_time + k*scan_period
+        secs = int(timestamp)
+        nsecs = int(round((timestamp - secs)*10**9))
+        yield {"header": {"seq": k, "stamp": {"secs": secs, "nsecs": nsecs}, "frame_id": "radar"}, "scan": scan}
+
+
+def write_synthetic_json(file_path, **kwargs):
+    """
+    Writes a synthetic recording to file_path, one scan at a time. The keyword arguments are passed to generate_scans.
+    """
+    with open(file_path, "w") as f:
+        f.write("[")
+        for k, scan in enumerate(generate_scans(**kwargs)):
+            if k > 0:
+                f.write(", ")
+            json.dump(scan, f)
+        f.write("]")
+    return file_path
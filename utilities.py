@@ -1,139 +1,301 @@
 import numpy as np
+import math
 import os
 import glob
-from matplotlib.cm import get_cmap
-from shapely.geometry import Point
+from scan_data import ScanData
+
+# The measurements of a track are stored in a structured array, with -1 for a missing scan_index or measurement_index
+track_dtype = np.dtype([('timestamp', np.float64), ('x', np.float64), ('y', np.float64),
+                        ('scan_index', np.int64), ('measurement_index', np.int64)])
 
 class Track:
+    __slots__ = ("track_id", "_points", "_number_of_points")
+
     def __init__(self, track_id):
         self.track_id = track_id
-        self.measurements = []
+        self._points = np.empty(4, dtype=track_dtype)
+        self._number_of_points = 0
+
+    def add_measurement(self, timestamp, x, y, scan_index=None, measurement_index=None):
+        # scan_index and measurement_index tell where the measurement is in the measurement_dict it came from
+        if self._number_of_points == len(self._points):
+            # Doubling the size keeps adding a measurement O(1) on average
+            points = np.empty(2*len(self._points), dtype=track_dtype)
+            points[:self._number_of_points] = self._points
+            self._points = points
+        self._points[self._number_of_points] = (timestamp, x, y,
+                                                -1 if scan_index is None else scan_index,
+                                                -1 if measurement_index is None else measurement_index)
+        self._number_of_points += 1
 
-    def add_measurement(self, timestamp, x, y):
-        self.measurements.append({'timestamp': timestamp, 'x': x, 'y': y})
+    @property
+    def points(self):
+        """
+        The measurements as a structured array with the fields timestamp, x, y, scan_index and measurement_index
+        """
+        return self._points[:self._number_of_points]
+
+    @property
+    def measurements(self):
+        """
+        The measurements as a list of dicts, like they were stored before. Made on each call, so use points where possible.
+        """
+        measurements = []
+        for timestamp, x, y, scan_index, measurement_index in self.points.tolist():
+            measurements.append({'timestamp': timestamp, 'x': x, 'y': y,
+                                 'scan_index': None if scan_index < 0 else scan_index,
+                                 'measurement_index': None if measurement_index < 0 else measurement_index})
+        return measurements
 
     def sort_by_timestamp(self):
-        self.measurements = sorted(self.measurements, key=lambda k: k['timestamp'])
+        points = self.points
+        points[:] = points[np.argsort(points['timestamp'], kind='stable')]
 
     def calculate_distance(self):
-        if len(self.measurements) < 2:
+        if self._number_of_points < 2:
             return 0.0  # Distance is zero if there's only one measurement
 
-        start_point = (self.measurements[0]['x'], self.measurements[0]['y'])
-        end_point = (self.measurements[-1]['x'], self.measurements[-1]['y'])
-        return euclidean_distance(start_point, end_point)
-    
+        points = self.points
+        return euclidean_distance((points['x'][0], points['y'][0]), (points['x'][-1], points['y'][-1]))
+
     def total_distance(self):
-        total_distance = 0
-        for i in range(len(self.measurements)-1):
-            total_distance += euclidean_distance((self.measurements[i]['x'], self.measurements[i]['y']), (self.measurements[i+1]['x'], self.measurements[i+1]['y']))
-        return total_distance
+        points = self.points
+        return np.sum(np.sqrt(np.diff(points['x'])**2 + np.diff(points['y'])**2))
+
+    def __len__(self):
+        return self._number_of_points
 
     def __repr__(self) -> str:
-        temp_str = f"Track {self.track_id} with {len(self.measurements)} measurements\n"
-        for measurement in self.measurements:
-            temp_str += f"Timestamp: {measurement['timestamp']:.2f}, x: {measurement['x']:.2f}, y: {measurement['y']:.2f}\n"
+        temp_str = f"Track {self.track_id} with {self._number_of_points} measurements\n"
+        for timestamp, x, y, _, _ in self.points.tolist():
+            temp_str += f"Timestamp: {timestamp:.2f}, x: {x:.2f}, y: {y:.2f}\n"
         return temp_str  
 
 def euclidean_distance(point1, point2):
     return np.sqrt((point1[0] - point2[0]) ** 2 + (point1[1] - point2[1]) ** 2)
 
-def nearest_neighbor(measurement_dict):
+def nearest_neighbor(measurement_dict, time_horizon=None):
+    """
+    Adds each measurement to the track with the closest last measurement, if it is closer than the threshold, otherwise
+    a new track is made. The last positions of the tracks are kept in a grid with cells as large as the threshold, so each
+    measurement is only compared with the tracks in the surrounding cells. Tracks that have not been updated for more than
+    time_horizon seconds are removed from the grid. With time_horizon=None no tracks are removed, and the result is the
+    same as comparing each measurement with every track.
+    """
     measurement_distance_threshold = 10
     tracks = []
     track_counter = 0
 
+    # Last position and timestamp of each track, and the tracks in each grid cell
+    last_xs = np.zeros(64)
+    last_ys = np.zeros(64)
+    last_timestamps = {}
+    grid = {}
+
+    def grid_cell(x, y):
+        return (math.floor(x / measurement_distance_threshold), math.floor(y / measurement_distance_threshold))
+
+    def new_track(timestamp, x, y, scan_index, measurement_index):
+        nonlocal last_xs, last_ys, track_counter
+        track = Track(track_counter)
+        track.add_measurement(timestamp, x, y, scan_index, measurement_index)
+        tracks.append(track)
+        if track_counter == len(last_xs):
+            last_xs = np.concatenate((last_xs, np.zeros(len(last_xs))))
+            last_ys = np.concatenate((last_ys, np.zeros(len(last_ys))))
+        last_xs[track_counter] = x
+        last_ys[track_counter] = y
+        last_timestamps[track_counter] = timestamp
+        grid.setdefault(grid_cell(x, y), set()).add(track_counter)
+        track_counter += 1
+
     data = measurement_dict
-    for timestamp in data:
-        measurements = data[timestamp]
+    if isinstance(data, ScanData):
+        # Only the positions are needed, so they are taken directly from the arrays
+        scans = ((timestamp, list(zip(data.x[data.scan_slice(k)].tolist(), data.y[data.scan_slice(k)].tolist())))
+                 for k, timestamp in enumerate(data.timestamps.tolist()))
+    else:
+        scans = data.items()
+
+    for scan_index, (timestamp, measurements) in enumerate(scans):
+        if time_horizon is not None:
+            for track_index, last_timestamp in list(last_timestamps.items()):
+                if timestamp - last_timestamp > time_horizon:
+                    cell = grid_cell(last_xs[track_index], last_ys[track_index])
+                    grid[cell].discard(track_index)
+                    if not grid[cell]:
+                        del grid[cell]
+                    del last_timestamps[track_index]
 
         if not tracks:
-            for measurement in measurements:
-                track = Track(track_counter)
+            for measurement_index, measurement in enumerate(measurements):
                 y = measurement[0]
                 x = measurement[1]
-                track.add_measurement(timestamp, x, y)
-                tracks.append(track)
-                track_counter += 1
+                new_track(timestamp, x, y, scan_index, measurement_index)
             continue
 
-        for measurement in measurements:
-            distances = []
+        for measurement_index, measurement in enumerate(measurements):
             y = measurement[0]
             x = measurement[1]
-            for track in tracks:
-                distances.append(euclidean_distance((track.measurements[-1]['x'], track.measurements[-1]['y']), (x, y)))
-     
-            if min(distances) < measurement_distance_threshold:
-                tracks[distances.index(min(distances))].add_measurement(timestamp, x, y)
+            cell_x, cell_y = grid_cell(x, y)
+            candidates = []
+            for neighbour_x in (cell_x - 1, cell_x, cell_x + 1):
+                for neighbour_y in (cell_y - 1, cell_y, cell_y + 1):
+                    candidates.extend(grid.get((neighbour_x, neighbour_y), ()))
+
+            track_index = None
+            if candidates:
+                # Sorted so ties go to the oldest track, as when comparing with every track
+                candidates = np.sort(np.array(candidates))
+                distances = np.sqrt((last_xs[candidates] - x)**2 + (last_ys[candidates] - y)**2)
+                closest = np.argmin(distances)
+                if distances[closest] < measurement_distance_threshold:
+                    track_index = int(candidates[closest])
+
+            if track_index is not None:
+                tracks[track_index].add_measurement(timestamp, x, y, scan_index, measurement_index)
+                old_cell = grid_cell(last_xs[track_index], last_ys[track_index])
+                new_cell = grid_cell(x, y)
+                if old_cell != new_cell:
+                    grid[old_cell].discard(track_index)
+                    if not grid[old_cell]:
+                        del grid[old_cell]
+                    grid.setdefault(new_cell, set()).add(track_index)
+                last_xs[track_index] = x
+                last_ys[track_index] = y
+                last_timestamps[track_index] = timestamp
             else:
-                track = Track(track_counter)
-                track.add_measurement(timestamp, x, y)
-                tracks.append(track)
-                track_counter += 1
+                new_track(timestamp, x, y, scan_index, measurement_index)
 
     return tracks
 
-def filter_tracks(tracks):
-    new_tracks = []
-    not_stationary_objects = []
-    track_ids = []
-    for i, track in enumerate(tracks):
-        track_ids.append(track.track_id)
+def inside_buffer_polygon(dx, dy, radius, number_of_segments=64):
+    """
+    Checks if the points (dx, dy), relative to the center, are inside the polygon shapely makes with
+    Point(center).buffer(radius). The polygon has number_of_segments vertices on the circle, going clockwise from angle 0,
+    and the points on the edges are not inside, as with shapely's contains.
+    """
+    angle_increment = 2*np.pi/number_of_segments
+    vertex_angles = -angle_increment*np.arange(number_of_segments + 1)
+    vertex_xs = radius*np.cos(vertex_angles)
+    vertex_ys = radius*np.sin(vertex_angles)
 
-    for i, track in enumerate(tracks):
-        # want to draw a circle around the first track point, and if some other track point is outside of the circle, remove the track
-        if len(track.measurements) < 2:
+    # The polygon is convex around the center, so only the edge in the same direction as the point has to be checked
+    edge = np.floor(np.mod(-np.arctan2(dy, dx), 2*np.pi)/angle_increment).astype(int)
+    edge = np.clip(edge, 0, number_of_segments - 1)
+    edge_x = vertex_xs[edge + 1] - vertex_xs[edge]
+    edge_y = vertex_ys[edge + 1] - vertex_ys[edge]
+    # The polygon goes clockwise, so the inside is to the right of the edges
+    cross = edge_x*(dy - vertex_ys[edge]) - edge_y*(dx - vertex_xs[edge])
+    return cross < 0
+
+def filter_tracks(tracks, mode="polygon", radius=30):
+    """
+    Removes the stationary tracks, i.e. the tracks that never get further than radius from the first measurement.
+    In "circle" mode the distance from the first measurement is compared with radius. In "polygon" mode the points are
+    checked against the polygon from shapely's Point(...).buffer(radius), which gives the same tracks as doing the check
+    with shapely.
+    """
+    if mode not in ("circle", "polygon"):
+        raise ValueError(f"Unknown filter mode {mode}, should be 'circle' or 'polygon'")
+
+    not_stationary_objects = set()
+    for track in tracks:
+        if len(track) < 2:
             continue
-        start_point = (track.measurements[0]['x'], track.measurements[0]['y'])
-        circle = Point(start_point[0], start_point[1]).buffer(30)
-        for measurement in track.measurements:
-            if not circle.contains(Point(measurement['x'], measurement['y'])):
-                not_stationary_objects.append(track.track_id)
-                break
+        xs = track.points['x']
+        ys = track.points['y']
+        dx = xs - xs[0]
+        dy = ys - ys[0]
+        if mode == "circle":
+            inside = np.sqrt(dx**2 + dy**2) < radius
+        else:
+            inside = inside_buffer_polygon(dx, dy, radius)
+        if not np.all(inside):
+            not_stationary_objects.add(track.track_id)
 
+    new_tracks = []
     for track in tracks:
         if track.track_id in not_stationary_objects:
             new_tracks.append(track)
     return new_tracks
 
-def convert_tracks_to_measurement_dict(tracks, old_measurement_dict):
+def convert_tracks_to_measurement_dict(tracks, old_measurement_dict, save_path=None):
+    """
+    Makes a measurement_dict with only the measurements that are in the tracks. The measurements are found using the
+    scan_index and measurement_index stored in the tracks by nearest_neighbor. If old_measurement_dict is a ScanData, the
+    result is also a ScanData. The result is only saved to save_path if it is given.
+    """
+    if isinstance(old_measurement_dict, ScanData):
+        data = old_measurement_dict
+        indices = []
+        for track in tracks:
+            points = track.points
+            track_indices = data.scan_offsets[points['scan_index']] + points['measurement_index']
+            # Tracks not made by nearest_neighbor have no back-references, so the measurement is found by its position
+            for k in np.flatnonzero(points['measurement_index'] < 0).tolist():
+                timestamp, x, y, _, _ = points[k].tolist()
+                scan_index = data.scan_index(timestamp)
+                if scan_index is None:
+                    raise KeyError(timestamp)
+                scan = data.scan_slice(scan_index)
+                matches = np.flatnonzero((data.y[scan] == x) & (data.x[scan] == y))
+                track_indices[k] = scan.start + matches[0] if len(matches) else -1
+            indices.append(track_indices[track_indices >= 0])
+        indices = np.concatenate(indices) if indices else np.zeros(0, dtype=np.int64)
+        measurement_dict = old_measurement_dict.select(indices)
+        if save_path is not None:
+            measurement_dict.save(save_path)
+        return measurement_dict
+
     measurement_dict = {}
     # measurement_dict['Timestamp'] = ["x","y","area","polygon_xs","polygon_ys"]
 
     for i, track in enumerate(tracks):
-        for measurement in track.measurements:
-            timestamp = measurement['timestamp']
+        for timestamp, x, y, _, measurement_index in track.points.tolist():
             if not timestamp in measurement_dict:
                 measurement_dict[timestamp] = []
-            # Need to find the corresponding measurement in the old measurement dict
+            if measurement_index >= 0:
+                measurement_dict[timestamp].append(old_measurement_dict[timestamp][measurement_index])
+                continue
+            # Tracks not made by nearest_neighbor need to find the corresponding measurement in the old measurement dict
             for old_measurement in old_measurement_dict[timestamp]:
-                if (old_measurement[1], old_measurement[0]) == (measurement['x'], measurement['y']):
+                if (old_measurement[1], old_measurement[0]) == (x, y):
                     measurement_dict[timestamp].append(old_measurement)
                     break
 
 
     measurement_dict = dict(sorted(measurement_dict.items()))
-    np.save("measurement_dict.npy", measurement_dict)   
+    if save_path is not None:
+        np.save(save_path, measurement_dict)
     return measurement_dict
 
-def add_color_scaling(measurement_dict):
-    data = measurement_dict
+def color_scaling(timestamps):
+    """
+    Returns one RGBA color for each timestamp, going from light to dark gray over the recording
+    """
+    # Imported here, so the tracking does not need matplotlib
+    from matplotlib.cm import get_cmap
     cmap = get_cmap('Greys')
-    timestamps = []
-    for timestamp, measurements in data.items():
-        timestamps.append(timestamp)
-    timestamps = np.asarray(timestamps)
+    timestamps = np.asarray(timestamps, dtype=float)
     interval = (timestamps-timestamps[0]+timestamps[-1]/5)/(timestamps[-1]-timestamps[0]+timestamps[-1]/5)
+    return cmap(interval)
 
-    for timestamp, measurements in data.items():
-        # Iterate over each measurement and assign a color based on position
-        for index, measurement in enumerate(measurements):
-            measurement_color = cmap(interval[timestamps == timestamp])
+def add_color_scaling(measurement_dict):
+    """
+    Adds a color to the measurements based on their timestamp. The colors are calculated once for all the scans. A
+    ScanData stores them in scan_colors, while for a measurement_dict the color of the scan is appended to each of its
+    measurements, with all the measurements of a scan sharing the same color array.
+    """
+    data = measurement_dict
+    if isinstance(data, ScanData):
+        data.scan_colors = color_scaling(data.timestamps)
+        return data
 
-            # Append the color value to the measurement
-            measurement.append(measurement_color.squeeze())
-           
+    colors = color_scaling(list(data.keys()))
+    for measurements, color in zip(data.values(), colors):
+        for measurement in measurements:
+            measurement.append(color)
 
     return data
 